@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pyro serializer for numpy arrays with out-of-band buffers.
+
+Pyro's own pickle serializer copies array data several times: numpy
+copies the array into a bytes object, which is copied into the
+pickle stream, which is copied again on load.  This serializer uses
+pickle protocol 5 (PEP 574) so that contiguous buffers, such as numpy
+arrays, are kept out of the pickle stream.  They are copied once into
+the message on send, and once into a single writable buffer on
+receive, which the arrays then use without further copies.
+
+The serializer is registered with Pyro on import under the name
+:data:`NAME`.  If pickle protocol 5 is not available (Python < 3.8)
+:data:`NAME` is simply ``'pickle'``.
+
+The message format is::
+
+    | n_buffers | pickle length | buffer lengths | pickle | buffers |
+
+where the lengths are unsigned 64 bit integers in network order.
+"""
+
+import pickle
+import struct
+
+import Pyro4
+import Pyro4.util
+
+
+# Pyro uses 1 to 7 for its own serializers.
+_SERIALIZER_ID = 57
+
+_COUNT = struct.Struct('!Q')
+
+
+class OutOfBandPickleSerializer(Pyro4.util.PickleSerializer):
+    serializer_id = _SERIALIZER_ID
+
+    def dumpsCall(self, obj, method, vargs, kwargs):
+        return self.dumps((obj, method, vargs, kwargs))
+
+    def dumps(self, data):
+        buffers = []
+        stream = pickle.dumps(data, protocol=5,
+                              buffer_callback=buffers.append)
+        raws = [b.raw() for b in buffers]
+        lengths = [len(stream)] + [r.nbytes for r in raws]
+        header = struct.pack('!%dQ' % (len(lengths) +1), len(raws), *lengths)
+
+        message = bytearray(len(header) + sum(lengths))
+        view = memoryview(message)
+        view[:len(header)] = header
+        offset = len(header)
+        for chunk in [stream] + raws:
+            view[offset:offset+len(chunk)] = chunk
+            offset += len(chunk)
+        return message
+
+    def loadsCall(self, data):
+        return self.loads(data)
+
+    def loads(self, data):
+        view = memoryview(data)
+        n_buffers = _COUNT.unpack_from(view)[0]
+        lengths = struct.unpack_from('!%dQ' % (n_buffers +1), view,
+                                     _COUNT.size)
+        offset = _COUNT.size * (n_buffers +2)
+        stream = view[offset:offset+lengths[0]]
+        offset += lengths[0]
+
+        # One copy of all buffers together into writable memory, so
+        # that the arrays built on top of them are writable.
+        payload = memoryview(bytearray(view[offset:]))
+        buffers = []
+        offset = 0
+        for length in lengths[1:]:
+            buffers.append(payload[offset:offset+length])
+            offset += length
+        return pickle.loads(stream, buffers=buffers)
+
+
+if pickle.HIGHEST_PROTOCOL >= 5:
+    NAME = 'microscope'
+    _serializer = OutOfBandPickleSerializer()
+    Pyro4.util._serializers[NAME] = _serializer
+    Pyro4.util._serializers_by_id[_serializer.serializer_id] = _serializer
+else:
+    NAME = 'pickle'
+
+
+def serializer_of_current_call():
+    """Name of the serializer used in the current Pyro call.
+
+    Returns `None` if not called via Pyro.  Used to call back a client
+    with the serializer it used to reach us, since it may not accept
+    our default serializer.
+    """
+    serializer_id = getattr(Pyro4.current_context, 'serializer_id', 0)
+    for name, serializer in Pyro4.util._serializers.items():
+        if serializer.serializer_id == serializer_id:
+            return name
+    return None
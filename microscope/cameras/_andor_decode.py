@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Decode AndorSDK3 image buffers with numpy.
+
+This is separate from :mod:`microscope.cameras.andorsdk3`, which
+loads the SDK on import, so that it can be tested without the SDK.
+"""
+
+import numpy as np
+
+
+def decode_mono12packed(rows, width):
+    """Decode rows of pairs of 12 bit pixels packed in 3 bytes.
+
+    The first byte has the 8 high bits of the first pixel, the second
+    byte has the 4 low bits of the first pixel in its low nibble and
+    the 4 low bits of the second pixel in its high nibble, and the
+    third byte has the 8 high bits of the second pixel.
+    """
+    height, stride = rows.shape
+    n_pairs = (width + 1) // 2
+    if 3 * n_pairs <= stride:
+        packed = rows[:, :3 * n_pairs].astype(np.uint16)
+    else:
+        # The last pair of an odd width may not fit in the stride.
+        packed = np.zeros((height, 3 * n_pairs), dtype=np.uint16)
+        packed[:, :stride] = rows
+    data = np.empty((height, 2 * n_pairs), dtype=np.uint16)
+    data[:, 0::2] = (packed[:, 0::3] << 4) | (packed[:, 1::3] & 0xF)
+    data[:, 1::2] = (packed[:, 2::3] << 4) | (packed[:, 1::3] >> 4)
+    return np.ascontiguousarray(data[:, :width])
+
+
+def decode_buffer(raw, width, height, stride, encoding):
+    """Decode a buffer with numpy instead of the SDK.
+
+    Returns a new uint16 array, so that the buffer can be reused, or
+    `None` if the pixel encoding is not supported.  Mono32 is not
+    supported so that, like all other images, it is converted to
+    uint16 by the SDK whether the numpy decoder is used or not.
+    """
+    rows = raw[:height * stride].reshape(height, stride)
+    if encoding == 'Mono12Packed':
+        return decode_mono12packed(rows, width)
+    elif encoding in ('Mono12', 'Mono16'):
+        # Copy before the view because padded rows are not
+        # contiguous, and numpy<1.23 can't view them as another dtype.
+        return rows[:, :2 * width].copy().view('<u2')
+    else:
+        return None
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Frames on the circular buffer of a PVCAM camera.
+
+This is separate from :mod:`microscope.cameras.pvcam`, which loads
+the SDK on import, so that it can be tested without the SDK.
+"""
+
+import threading
+
+
+class Frame:
+    """A frame on a slot of a `CircularBufferFrames`."""
+    def __init__(self, owner, slot, data):
+        self.owner = owner
+        self.slot = slot
+        self.data = data
+        self.dispatching = False
+
+
+class CircularBufferFrames:
+    """Hand out frames as views of the slots of a circular buffer.
+
+    Instead of copying each frame out of the PVCAM circular buffer on
+    the callback thread, frames are put in the dispatch buffer as
+    views of the slot they were written to.  The slot is owned by the
+    frame until it is dispatched.
+
+    With ``CIRC_OVERWRITE`` the SDK writes to the slots in order
+    whether they are owned or not.  When the end of the frame on
+    `slot` is signalled, the SDK is already writing to the next slot
+    and will then write to the one after.  Frames still waiting on
+    those slots are copied then, and only then.  Frames that are
+    already being sent can't be copied and may be torn; those are
+    counted in `late`, and mean that the circular buffer is too short
+    for the rate of dispatch.
+
+    A buffer with no more than ``_GUARD +1`` slots has no slot that
+    the SDK won't write to before the next callback, so its frames
+    are copied as soon as they are taken.
+    """
+    # Slots ahead of the last written that the SDK may write to
+    # before the next end-of-frame callback.
+    _GUARD = 2
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._lock = threading.Lock()
+        # Frames not yet dispatched, by slot.
+        self._owned = {}
+        self.copies = 0
+        self.late = 0
+
+    def slot_of(self, address):
+        """Index of the slot at memory address."""
+        return ((address - self._buffer.ctypes.data)
+                // self._buffer[0].nbytes)
+
+    def take(self, slot):
+        """Return a frame for the slot just written by the SDK."""
+        with self._lock:
+            if len(self._buffer) <= self._GUARD +1:
+                self.copies += 1
+                return Frame(self, slot, self._buffer[slot].copy())
+            frame = Frame(self, slot, self._buffer[slot])
+            self._owned[slot] = frame
+            for ahead in range(1, self._GUARD +1):
+                pending = self._owned.pop((slot + ahead) % len(self._buffer),
+                                          None)
+                if pending is None:
+                    continue
+                if pending.dispatching:
+                    self.late += 1
+                else:
+                    pending.data = pending.data.copy()
+                    self.copies += 1
+            return frame
+
+    def claim(self, frame):
+        """Return the data of a frame about to be dispatched."""
+        with self._lock:
+            frame.dispatching = True
+            return frame.data
+
+    def release(self, frame):
+        """Give the slot of a dispatched frame back to the SDK."""
+        with self._lock:
+            if self._owned.get(frame.slot) is frame:
+                del self._owned[frame.slot]
@@ -22,13 +22,16 @@ This class provides a wrapper for PYME's SDK3 interface that allows
 a camera and all its settings to be exposed over Pyro.
 """
 
+import concurrent.futures
 import logging
 import queue
+import threading
 import time
 
 import numpy as np
 
 from microscope import devices
+from microscope.cameras._andor_decode import decode_buffer
 from microscope.devices import keep_acquiring
 from microscope.devices import ROI
 
@@ -290,6 +293,24 @@ class AndorSDK3(devices.FloatingDeviceMixin,
         self._img_encoding = None
         self._buffers_valid = False
         self._exposure_callback = None
+        # Buffers are converted, and queued back, on a pool of
+        # threads so that the fetch thread only waits for buffers.
+        # The generation changes when buffers are purged so that old
+        # buffers still being converted are not queued again.
+        self._requeue_lock = threading.Lock()
+        self._buffers_generation = 0
+        self._conversion_threads = 2
+        self._converter = concurrent.futures.ThreadPoolExecutor(
+            self._conversion_threads)
+        self.add_setting('conversion_threads', 'int',
+                         lambda: self._conversion_threads,
+                         self.set_conversion_threads,
+                         lambda: (1, 16))
+        self._numpy_decoder = False
+        self.add_setting('numpy_decoder', 'bool',
+                         lambda: self._numpy_decoder,
+                         lambda val: setattr(self, '_numpy_decoder', val),
+                         None)
 
     @property
     def _acquiring(self):
@@ -324,18 +345,27 @@ class AndorSDK3(devices.FloatingDeviceMixin,
         self.num_buffers = num
         self._buffers_valid = False
 
+    def set_conversion_threads(self, num):
+        old_converter = self._converter
+        self._converter = concurrent.futures.ThreadPoolExecutor(num)
+        self._conversion_threads = num
+        # Conversions already submitted still complete.
+        old_converter.shutdown(wait=False)
+
     def _purge_buffers(self):
         """Purge buffers on both camera and PC."""
         _logger.debug("Purging buffers.")
         self._buffers_valid = False
         if self._acquiring:
             raise Exception ('Can not modify buffers while camera acquiring.')
-        SDK3.Flush(self.handle)
-        while True:
-            try:
-                self.buffers.get(block=False)
-            except queue.Empty:
-                break
+        with self._requeue_lock:
+            self._buffers_generation += 1
+            SDK3.Flush(self.handle)
+            while True:
+                try:
+                    self.buffers.get(block=False)
+                except queue.Empty:
+                    break
 
     def _create_buffers(self, num=None):
         """Create buffers and store values needed to remove padding later."""
@@ -371,7 +401,11 @@ class AndorSDK3(devices.FloatingDeviceMixin,
         return wrapper
 
     def _fetch_data(self, timeout=5, debug=False):
-        """Fetch data and recycle buffers."""
+        """Fetch data and start its conversion on another thread.
+
+        Returns a Future for the image, which the dispatch loop waits
+        for, so images are still sent in order.
+        """
         try:
             ptr, length = SDK3.WaitBuffer(self.handle, timeout)
         except SDK3.TimeoutError as e:
@@ -381,22 +415,45 @@ class AndorSDK3(devices.FloatingDeviceMixin,
         except Exception:
             raise
         raw = self.buffers.get()
-        width = self._img_width
-        height = self._img_height
-        data = raw#.reshape((-1, bytes_per_row))[:, 0:width].copy()
-        data = np.empty((height, width), dtype='uint16')
-        SDK3.ConvertBuffer(ptr, data.ctypes.data_as(DPTR_TYPE),
-                           width, height,
-                           self._img_stride, self._img_encoding, 'Mono16')
-        # Requeue the buffer if buffer size has not been changed elsewhere.
-        if raw.size == self._buffer_size:
-            self.buffers.put(raw)
-            SDK3.QueueBuffer(self.handle, ptr, length)
-        else:
-            del raw
-
+        return self._converter.submit(self._convert_buffer, raw, ptr, length,
+                                      self._buffers_generation,
+                                      self._img_width, self._img_height,
+                                      self._img_stride, self._img_encoding)
+
+    def _convert_buffer(self, raw, ptr, length, generation, width, height,
+                        stride, encoding):
+        """Convert buffer to an image and recycle the buffer."""
+        try:
+            data = None
+            if self._numpy_decoder:
+                data = decode_buffer(raw, width, height, stride, encoding)
+            if data is None:
+                data = np.empty((height, width), dtype='uint16')
+                SDK3.ConvertBuffer(ptr, data.ctypes.data_as(DPTR_TYPE),
+                                   width, height, stride, encoding, 'Mono16')
+        finally:
+            # Requeue the buffer if buffers have not been changed
+            # elsewhere.  Queue it on the SDK and on self.buffers
+            # together, so that both queues keep the same order.
+            with self._requeue_lock:
+                if (raw.size == self._buffer_size
+                        and generation == self._buffers_generation):
+                    self.buffers.put(raw)
+                    SDK3.QueueBuffer(self.handle, ptr, length)
         return data
 
+    def _process_data(self, data):
+        """Wait for the conversion of the image."""
+        if isinstance(data, concurrent.futures.Future):
+            try:
+                data = data.result()
+            except Exception as e:
+                # Send the error to the client instead of the image,
+                # like _fetch_loop does for errors fetching it.
+                self._log_fetch_error("converting image:", exc_info=e)
+                return Exception(str(e).encode('ascii'))
+        return super()._process_data(data)
+
     def abort(self):
         """Abort acquisition."""
         _logger.debug('Disabling acquisition.')
@@ -482,6 +539,7 @@ class AndorSDK3(devices.FloatingDeviceMixin,
 
     def _on_shutdown(self):
         self.set_cooling(False)
+        self._converter.shutdown()
         SDK3.Close(self.handle)
 
     def _on_disable(self):
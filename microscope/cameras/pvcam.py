@@ -127,6 +127,7 @@ This module exposes pvcam C library functions in python.
 
 """
 
+import collections
 import ctypes
 import logging
 import os
@@ -137,6 +138,7 @@ import Pyro4
 import numpy as np
 
 from microscope import devices
+from microscope.cameras._pvcam_frames import CircularBufferFrames, Frame
 from microscope.devices import ROI, Binning
 from microscope.devices import keep_acquiring
 
@@ -844,7 +846,7 @@ dllFunc('pl_create_smart_stream_struct', [OUTPUT(smart_stream_type), uns16],
         ['pSmtStruct', 'entries'])
 dllFunc('pl_release_smart_stream_struct', [ctypes.POINTER(smart_stream_type),],
         ['pSmtStruct',])
-dllFunc('pl_create_frame_info_struct', [OUTPUT(FRAME_INFO),],
+dllFunc('pl_create_frame_info_struct', [OUTPUT(ctypes.POINTER(FRAME_INFO)),],
         ['pNewFrameInfo'])
 dllFunc('pl_release_frame_info_struct', [ctypes.POINTER(FRAME_INFO),],
         ['pFrameInfoToDel',])
@@ -971,6 +973,12 @@ def get_param_dtype(param_id):
     return _dtypemap[param_id >> 24 & 255]
 
 
+# Parameters that, when set, may change the attributes of other
+# parameters, such as their range or availability.
+_INVALIDATING_PARAMS = (PARAM_READOUT_PORT, PARAM_SPDTAB_INDEX,
+                        PARAM_GAIN_INDEX, PARAM_PMODE, PARAM_EXP_RES)
+
+
 # Map status codes to strings.
 STATUS_STRINGS = {READOUT_NOT_ACTIVE: 'READOUT_NOT_ACTIVE',
                   EXPOSURE_IN_PROGRESS: 'EXPOSURE_IN_PROGRESS',
@@ -1037,6 +1045,26 @@ class PVParam():
         self.dtype = _dtypemap[self._pvtype]
         self._ctype = _typemap[self._pvtype]
         self.__cache = {}
+        # Attributes other than the current value.  These only change
+        # when some other parameters are set, see invalidate().
+        self._attrs = {}
+
+    def invalidate(self):
+        """Forget cached attributes.
+
+        Called when parameters in `_INVALIDATING_PARAMS`, such as the
+        readout port, are set.
+        """
+        self._attrs = {}
+
+    def _get_attr(self, what):
+        """Get, and cache, the ACCESS, AVAIL, COUNT, or TYPE attribute."""
+        try:
+            return self._attrs[what]
+        except KeyError:
+            value = _get_param(self.cam.handle, self.param_id, what).value or 0
+            self._attrs[what] = value
+            return value
 
     def set_value(self, new_value):
         """Set a parameter value.
@@ -1048,15 +1076,26 @@ class PVParam():
         except TypeError:
             # Need to convert python type to ctype first.
             ref = ctypes.byref(self._ctype(new_value) )
+        # Parameters that invalidate the others are often set to the
+        # value they already have, e.g., on every enable, so only
+        # invalidate if the value actually changed.
+        invalidating = self.param_id in _INVALIDATING_PARAMS
+        if invalidating:
+            old_value = self._query(force_query=True)
         _set_param(self.cam.handle, self.param_id, ref)
         # Read back the value to update cache.
-        self._query(force_query=True)
+        value = self._query(force_query=True)
+        if invalidating and value != old_value:
+            self.cam._invalidate_params()
 
     def _query(self, what=ATTR_CURRENT, force_query=False):
         """Query the DLL for an attribute for this parameter.
 
-        This returns pythonic types, not ctypes."""
+        This returns pythonic types, not ctypes.  Attributes other
+        than the current value are cached until invalidated."""
         err = None
+        if what != ATTR_CURRENT and what in self._attrs:
+            return self._attrs[what]
         key = (self, what) # key for cache
         if self.cam._acquiring and not force_query:
             return self.__cache.get(key, None)
@@ -1064,10 +1103,8 @@ class PVParam():
             return self.available
         elif not self.available:
             raise Exception("Parameter %s is not available" % self.name)
-        rtype = _attr_map[what] # return type
-        if not rtype:
-            rtype = _get_param(self.cam.handle, self.param_id, ATTR_TYPE)
-        if rtype.value == TYPE_CHAR_PTR:
+        if (_attr_map[what] is None
+                and self._get_attr(ATTR_TYPE) == TYPE_CHAR_PTR):
             buf_len = _length_map[self.param_id]
             if not buf_len:
                 raise Exception('pvcam: parameter %s not supported in python.' % self.name)
@@ -1093,22 +1130,24 @@ class PVParam():
             raise e
         else:
             self.__cache[key] = result
+            if what != ATTR_CURRENT:
+                self._attrs[what] = result
         return result
 
     @property
     def access(self):
         """Return parameter access attribute."""
-        return int(_get_param(self.cam.handle, self.param_id, ATTR_ACCESS).value)
+        return int(self._get_attr(ATTR_ACCESS))
 
     @property
     def available(self):
         """Return whether or not parameter is available on hardware."""
-        return bool(_get_param(self.cam.handle, self.param_id, ATTR_AVAIL).value)
+        return bool(self._get_attr(ATTR_AVAIL))
 
     @property
     def count(self):
         """Return count of parameter enum entries."""
-        return int(_get_param(self.cam.handle, self.param_id, ATTR_COUNT).value)
+        return int(self._get_attr(ATTR_COUNT))
 
     @property
     def values(self):
@@ -1156,12 +1195,15 @@ class PVEnumParam(PVParam):
     @property
     def values(self):
         """Get allowable enum values"""
-        values = {}
-        for i in range(self.count):
-            length = _enum_str_length(self.cam.handle, self.param_id, i)
-            value, desc = _get_enum_param(self.cam.handle, self.param_id, i, length)
-            values[value.value] = desc.value.decode()
-        return values
+        values = self._attrs.get('values')
+        if values is None:
+            values = {}
+            for i in range(self.count):
+                length = _enum_str_length(self.cam.handle, self.param_id, i)
+                value, desc = _get_enum_param(self.cam.handle, self.param_id, i, length)
+                values[value.value] = desc.value.decode()
+            self._attrs['values'] = values
+        return dict(values)
 
 
 class PVStringParam(PVParam):
@@ -1212,6 +1254,23 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
         self._params = {}
         # Circular buffer length.
         self._circ_buffer_length = 10
+        # Whether to dispatch frames as views of the circular buffer,
+        # and the frames on it when enabled.
+        self._zero_copy = False
+        self._frames = None
+        # Whether to drain every frame, in order, from the circular
+        # buffer instead of only the latest.
+        self._drain_frames = False
+        # Hardware frame number of the last frame, number of frames
+        # dropped, and (frame number, BOF timestamp, EOF timestamp)
+        # of the frames acquired.
+        self._last_frame_nr = None
+        self._dropped_frames = 0
+        self._frame_info = collections.deque(maxlen=100000)
+        # FRAME_INFO for the circular buffer callback, allocated by
+        # PVCAM.
+        self._frame_info_p = None
+        self._log_dropped = devices.RateLimitedLog(_logger, logging.WARNING)
 
         # Add common settings.
         self.add_setting('exposure time',
@@ -1229,6 +1288,25 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
                          lambda: self._circ_buffer_length,
                          lambda value: setattr(self, '_circ_buffer_length', value),
                          (2, 100))
+        # Zero copy needs the slots written while the frame is
+        # handled by the callback, and those written after.  It
+        # can't be used together with draining all frames.
+        self.add_setting('zero-copy frames',
+                         'bool',
+                         lambda: self._zero_copy,
+                         self._set_zero_copy,
+                         None)
+        self.add_setting('drain all frames',
+                         'bool',
+                         lambda: self._drain_frames,
+                         self._set_drain_frames,
+                         None)
+        self.add_setting('dropped frames',
+                         'int',
+                         lambda: self._dropped_frames,
+                         None,
+                         (0, 2**31 -1),
+                         readonly=True)
 
     @property
     def _region(self):
@@ -1243,6 +1321,52 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
         # Not used: images fetched using callback.
         return None
 
+    def _process_data(self, data):
+        """Get data of frames still on the circular buffer."""
+        if isinstance(data, Frame):
+            data = data.owner.claim(data)
+        return super()._process_data(data)
+
+    def _on_data_dispatched(self, data):
+        """Release slot of the circular buffer."""
+        if isinstance(data, Frame):
+            data.owner.release(data)
+
+    def _set_zero_copy(self, value):
+        # When draining, the SDK does not write to a frame until it
+        # is unlocked and does not hand out newer frames while the
+        # oldest is locked.  A zero-copy frame stays locked until it
+        # is dispatched, and so the frames behind it would never be
+        # taken.
+        if value and self._drain_frames:
+            raise ValueError("zero-copy frames can't be used while"
+                             " draining all frames")
+        self._zero_copy = value
+
+    def _set_drain_frames(self, value):
+        if value and self._zero_copy:
+            raise ValueError("can't drain all frames while using"
+                             " zero-copy frames")
+        self._drain_frames = value
+
+    def _invalidate_params(self):
+        """Forget the cached attributes of all parameters."""
+        for param in self._params.values():
+            param.invalidate()
+
+    def _record_frame_info(self, frame_info):
+        """Record frame number and timestamps, and count dropped frames."""
+        frame_nr = frame_info.FrameNr
+        if (self._last_frame_nr is not None
+                and frame_nr > self._last_frame_nr +1):
+            dropped = frame_nr - self._last_frame_nr -1
+            self._dropped_frames += dropped
+            self._log_dropped("Dropped %d frames before frame %d.",
+                              dropped, frame_nr)
+        self._last_frame_nr = frame_nr
+        self._frame_info.append((frame_nr, frame_info.TimeStampBOF,
+                                 frame_info.TimeStamp))
+
 
     def _on_enable(self):
         """Enable the camera hardware and make ready to respond to triggers.
@@ -1251,11 +1375,13 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
         # Set exposure time resolution on camera and determine t_exp, the
         # integer value used to set exposure time on the hardware later.
         if self.exposure_time < 1e-3:
-            self._params[PARAM_EXP_RES].set_value(EXP_RES_ONE_MICROSEC)
+            exp_res = EXP_RES_ONE_MICROSEC
             t_exp = int(self.exposure_time * 1e6)
         else:
-            self._params[PARAM_EXP_RES].set_value(EXP_RES_ONE_MILLISEC)
+            exp_res = EXP_RES_ONE_MILLISEC
             t_exp = int(self.exposure_time * 1e3)
+        if self._params[PARAM_EXP_RES].current != exp_res:
+            self._params[PARAM_EXP_RES].set_value(exp_res)
         # Configure camera, allocate buffer, and register callback.
         if self._trigger == TRIG_SOFT:
             # Software triggering for single frames.
@@ -1264,7 +1390,10 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
             def cb():
                 """Soft trigger mode end-of-frame callback."""
                 timestamp = time.time()
-                frame = self._buffer.copy()
+                # Hand over the buffer itself, and use a new one for
+                # the next frame, which is cheaper than a copy.
+                frame = self._buffer
+                self._buffer = np.empty_like(frame)
                 _logger.debug("Fetched single frame.")
                 _exp_finish_seq(self.handle, CCS_CLEAR)
                 self._put(frame, timestamp)
@@ -1281,13 +1410,42 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
         else:
             # Use a circular buffer.
             self._using_callback = True
+            if self._frame_info_p is None:
+                self._frame_info_p = _create_frame_info_struct()
+            frame_info_p = self._frame_info_p
+            def put_frame(frame_p, timestamp):
+                self._record_frame_info(frame_info_p.contents)
+                slot = self._frames.slot_of(frame_p)
+                if self._zero_copy:
+                    frame = self._frames.take(slot)
+                else:
+                    frame = self._buffer[slot].copy()
+                    if self._drain_frames:
+                        _exp_unlock_oldest_frame(self.handle)
+                _logger.debug("Fetched frame from circular buffer.")
+                self._put(frame, timestamp)
             def cb():
                 """Circular buffer mode end-of-frame callback."""
                 timestamp = time.time()
-                frame_p = ctypes.cast(_exp_get_latest_frame(self.handle), ctypes.POINTER(uns16))
-                frame = np.ctypeslib.as_array(frame_p, (self.roi[2], self.roi[3])).copy()
-                _logger.debug("Fetched frame from circular buffer.")
-                self._put(frame, timestamp)
+                if not self._drain_frames:
+                    frame_p = _exp_get_latest_frame_ex(self.handle,
+                                                       frame_info_p).value
+                    put_frame(frame_p, timestamp)
+                    return
+                # PVCAM may signal multiple frames with one callback,
+                # so take all frames waiting, oldest first.  Each is
+                # copied and unlocked before taking the next.
+                while True:
+                    try:
+                        frame_p = _exp_get_oldest_frame_ex(
+                            self.handle, frame_info_p).value
+                    except Exception:
+                        break # no frames waiting
+                    if (self._last_frame_nr is not None
+                            and (frame_info_p.contents.FrameNr
+                                 <= self._last_frame_nr)):
+                        break
+                    put_frame(frame_p, timestamp)
                 return
             # Need to keep a reference to the callback.
             self._eof_callback = CALLBACK(cb)
@@ -1297,8 +1455,20 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
                             self.roi.width // self.binning.h)
             self._buffer = np.require(np.zeros(buffer_shape, dtype='uint16'),
                                           requirements=['C_CONTIGUOUS', 'ALIGNED', 'OWNDATA'])
+            if self._frames is not None and (self._frames.copies
+                                             or self._frames.late):
+                _logger.info("Previous acquisition copied %d frames before"
+                             " overwritten, %d were too late.",
+                             self._frames.copies, self._frames.late)
+            if self._drain_frames:
+                # The SDK won't overwrite frames until unlocked.
+                buffer_mode = CIRC_NO_OVERWRITE
+            else:
+                buffer_mode = CIRC_OVERWRITE
+            self._frames = CircularBufferFrames(self._buffer)
+            self._last_frame_nr = None
             nbytes = _exp_setup_cont(self.handle, 1, self._region,
-                                     TRIGGER_MODES[self._trigger].pv_mode, t_exp, CIRC_OVERWRITE).value
+                                     TRIGGER_MODES[self._trigger].pv_mode, t_exp, buffer_mode).value
 
 
 
@@ -1336,6 +1506,9 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
     def _on_shutdown(self):
         """Disable the hardware for a prolonged period of inactivity."""
         self.abort()
+        if self._frame_info_p is not None:
+            _release_frame_info_struct(self._frame_info_p)
+            self._frame_info_p = None
         _cam_close(self.handle)
         PVCamera.open_cameras.remove(self.handle)
         if not PVCamera.open_cameras:
@@ -1554,6 +1727,23 @@ class PVCamera(devices.FloatingDeviceMixin, devices.CameraDevice):
         return TRIGGER_MODES[self._trigger].microscope_mode
 
 
+    def get_frame_info(self):
+        """Return and forget the info of the frames acquired so far.
+
+        Only available for frames from the circular buffer, i.e., not
+        in software trigger mode.  Returns a list of tuples with the
+        frame number, and beginning and end of frame timestamps, as
+        reported by the camera, in the order the frames were taken.
+        Frame numbers restart at each acquisition.  Gaps in frame
+        numbers are frames that were dropped, which are also counted
+        in the 'dropped frames' setting.
+        """
+        info = []
+        while self._frame_info:
+            info.append(self._frame_info.popleft())
+        return info
+
+
     @Pyro4.oneway
     def soft_trigger(self):
         """Expose software triggering to a client.
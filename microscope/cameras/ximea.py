@@ -53,6 +53,9 @@ from microscope import devices
 
 _logger = logging.getLogger(__name__)
 
+# Logged for every image, so at most once per second.
+_log_fetched_image = devices.RateLimitedLog(_logger, logging.INFO)
+
 # During acquisition, we rely on catching timeout errors which then
 # get discarded.  However, with debug level set to warning (XiApi
 # default log level), we get XiApi messages on stderr for each timeout
@@ -196,8 +199,8 @@ class XimeaCamera(devices.TriggerTargetMixIn, devices.CameraDevice):
                 raise err
 
         data = self._img.get_image_data_numpy() # type: np.ndarray
-        _logger.info("Fetched imaged with dims %s and size %s.",
-                     data.shape, data.size)
+        _log_fetched_image("Fetched imaged with dims %s and size %s.",
+                           data.shape, data.size)
         return data
 
     def abort(self):
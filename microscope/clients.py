@@ -17,67 +17,673 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """TODO: complete this docstring
 """
-import inspect
+import concurrent.futures
+import contextlib
+import functools
 import itertools
+import json
+import math
+import os.path
 import queue
 import socket
+import stat
+import tempfile
 import threading
+import time
+import uuid
 
 import Pyro4
 
-# Pyro configuration. Use pickle because it can serialize numpy ndarrays.
+import microscope._serializer
+import microscope.devices
+
+# Pyro configuration.  Use our pickle serializer with out-of-band
+# buffers because it can serialize numpy ndarrays without copies.
 Pyro4.config.SERIALIZERS_ACCEPTED.add('pickle')
-Pyro4.config.SERIALIZER = 'pickle'
+Pyro4.config.SERIALIZERS_ACCEPTED.add(microscope._serializer.NAME)
+Pyro4.config.SERIALIZER = microscope._serializer.NAME
 
 LISTENERS = {}
 
+# Metadata (methods, oneway methods, and attributes) of remote objects,
+# keyed by their object id.  Device servers use the device class name
+# as object id so this is per device class.  The version of a device
+# class is not known without connecting, so stale metadata is only
+# noticed, and refreshed, when a member is not found.
+_METADATA_CACHE = {}
+
+
+def load_metadata_cache(filepath):
+    """Load metadata of remote objects saved to a file.
+
+    Clients of objects in the cache do not connect to the remote
+    object at construction, only on their first call.  Pyro sends the
+    metadata of the remote object with every new connection so the
+    cache does not save a request per connection.  If a remote object
+    has changed, e.g., a device server was updated, its metadata is
+    refreshed when a member is not found.
+    """
+    with open(filepath, 'r') as fh:
+        cache = json.load(fh)
+    for object_id, metadata in cache.items():
+        _METADATA_CACHE[object_id] = {k: set(v) for k, v in metadata.items()}
+
+
+def save_metadata_cache(filepath):
+    """Save metadata of all remote objects seen so far to a file."""
+    cache = {object_id: {k: sorted(v) for k, v in metadata.items()}
+             for object_id, metadata in _METADATA_CACHE.items()}
+    with open(filepath, 'w') as fh:
+        json.dump(cache, fh)
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    rank = math.ceil(percent / 100.0 * len(sorted_values))
+    return sorted_values[max(rank, 1) -1]
+
+
+def _ping_device(uri, count, timeout):
+    latencies = []
+    proxy = Pyro4.Proxy(uri)
+    proxy._pyroTimeout = timeout
+    try:
+        # Connect first, so that the connection handshake is not
+        # included in the latency.
+        proxy._pyroBind()
+    except Pyro4.errors.PyroError:
+        return latencies
+    for i in range(count):
+        start = time.monotonic()
+        try:
+            proxy.ping()
+        except Pyro4.errors.PyroError:
+            # The connection is not usable after a timeout.
+            proxy._pyroRelease()
+            continue
+        latencies.append(time.monotonic() - start)
+    proxy._pyroRelease()
+    return latencies
+
+
+# Maximum number of devices pinged at the same time by ping_devices.
+_MAX_PING_THREADS = 32
+
+
+def ping_devices(uris, count=10, timeout=1.0):
+    """Ping devices concurrently and report their round-trip latency.
+
+    Calls :meth:`microscope.devices.Device.ping` which does not
+    communicate with the hardware so this measures the latency of the
+    device server only.  Devices are pinged at the same time, up to
+    32 at once.
+
+    Args:
+        uris (list): URIs of the devices.
+        count (int): number of pings per device.
+        timeout (float): seconds to wait for each reply.
+
+    Returns:
+        A dict of URIs to dicts with the keys ``lost``, the number of
+        pings that failed or timed out, and ``min``, ``p50``, ``p90``,
+        ``p99``, and ``max``, the round-trip latencies in seconds.
+        The latencies are `None` if all pings were lost.
+    """
+    uris = [str(uri) for uri in uris]
+    if not uris:
+        return {}
+    max_workers = min(len(uris), _MAX_PING_THREADS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        all_latencies = ex.map(_ping_device, uris, itertools.repeat(count),
+                               itertools.repeat(timeout))
+    report = {}
+    for uri, latencies in zip(uris, all_latencies):
+        latencies = sorted(latencies)
+        stats = {'lost': count - len(latencies)}
+        for name, percent in [('min', 0), ('p50', 50), ('p90', 90),
+                              ('p99', 99), ('max', 100)]:
+            stats[name] = _percentile(latencies, percent) if latencies else None
+        report[uri] = stats
+    return report
+
+
+class _CallRecorder:
+    """Record method calls, returning a Future for the result of each."""
+    def __init__(self):
+        self.calls = []
+        self.futures = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def record(*args, **kwargs):
+            future = concurrent.futures.Future()
+            self.calls.append((name, args, kwargs))
+            self.futures.append(future)
+            return future
+        return record
+
+
+class _OnewayCaller:
+    """Make oneway method calls via a Client."""
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return functools.partial(self._client._call_oneway, name)
+
 
 class Client:
-    """Base Client object that makes methods on proxy available locally."""
-    def __init__(self, url):
-        self._url = url
-        self._proxy = None
+    """Base Client object that makes methods on proxy available locally.
+
+    Remote methods and attributes are resolved on first access.
+    Methods are then bound to the instance while attributes are read
+    from, and written to, the remote object every time.  Methods and
+    properties defined on the Client class take precedence.
+
+    A Pyro proxy can only make one call at a time.  To allow
+    concurrent calls from multiple threads, each call checks out a
+    proxy from a pool of up to `max_proxies` proxies, each with its
+    own connection.  Calls beyond that wait for a free proxy.
+
+    Methods can also be called without waiting for them to complete
+    via :attr:`oneway`.
+
+    If the metadata of the remote object is cached, see
+    :func:`load_metadata_cache`, the client only connects on its
+    first call.
+
+    If the remote object is on this computer and also served on a unix
+    socket, the client connects via the unix socket.
+
+    Args:
+        url (str): URI of the remote object.
+        max_proxies (int): maximum number of simultaneous connections
+            to the remote object.
+        timeout (float): seconds to wait for the remote object to
+            reply before raising :class:`Pyro4.errors.TimeoutError`.
+            If `None`, wait forever.
+    """
+    def __init__(self, url, max_proxies=4, timeout=None):
+        self._url = _prefer_unix_socket(url, timeout)
+        self._timeout = timeout
+        # Metadata of the remote object, and how many times it was
+        # refreshed.  Idle proxies are kept in the pool with the
+        # number of the metadata they were last given.
+        self._metadata = None
+        self._metadata_gen = 0
+        self._fresh_metadata = False
+        # Idle proxies and the number of proxies that can still be
+        # checked out.
+        self._proxy_pool = queue.LifoQueue()
+        self._proxy_slots = threading.BoundedSemaphore(max_proxies)
+        # Identifies this client on the remote device for oneway
+        # calls.  Sequence numbers of the last oneway call made and of
+        # the last oneway call whose errors were drained.  Sequence
+        # numbers restart with each session of the device server.
+        self._client_id = uuid.uuid4().hex
+        self._oneway_lock = threading.Lock()
+        self._oneway_session = None
+        self._oneway_seq = 0
+        self._oneway_drained_seq = 0
         self._connect()
 
     def _connect(self):
-        """Connect to a proxy and set up self passthrough to proxy methods."""
-        self._proxy = Pyro4.Proxy(self._url)
-        self._proxy._pyroGetMetadata()
+        """Use cached metadata if available, otherwise get it."""
+        self._metadata = _METADATA_CACHE.get(Pyro4.URI(self._url).object)
+        if self._metadata is None:
+            self._update_metadata()
+
+    def _new_proxy(self):
+        """Create a new proxy, with the known metadata if any."""
+        proxy = Pyro4.Proxy(self._url)
+        proxy._pyroTimeout = self._timeout
+        if self._metadata is not None:
+            self._set_proxy_metadata(proxy)
+        return proxy
+
+    def _set_proxy_metadata(self, proxy):
+        proxy._pyroMethods = set(self._metadata['methods'])
+        proxy._pyroOneway = set(self._metadata['oneway'])
+        proxy._pyroAttrs = set(self._metadata['attrs'])
+
+    @contextlib.contextmanager
+    def _checkout_proxy(self):
+        """Context manager to use a proxy from the pool."""
+        with self._proxy_slots:
+            try:
+                metadata_gen, proxy = self._proxy_pool.get_nowait()
+            except queue.Empty:
+                metadata_gen = self._metadata_gen
+                proxy = self._new_proxy()
+            if metadata_gen != self._metadata_gen:
+                # Metadata was refreshed since this proxy was used.
+                metadata_gen = self._metadata_gen
+                self._set_proxy_metadata(proxy)
+            try:
+                yield proxy
+            finally:
+                self._proxy_pool.put((metadata_gen, proxy))
+
+    def _call(self, name, *args, **kwargs):
+        """Call a remote method with a proxy from the pool.
+
+        If previous oneway calls failed, the first error is raised
+        instead.
+        """
+        if self._oneway_seq > self._oneway_drained_seq:
+            errors = self.get_oneway_errors()
+            if errors:
+                raise errors[0]
+        with self._checkout_proxy() as proxy:
+            return getattr(proxy, name)(*args, **kwargs)
+
+    @property
+    def oneway(self):
+        """Object to call remote methods without waiting for them.
+
+        Calls to its methods return as soon as the call is sent and
+        always return `None`.  Calls are made in order on the remote
+        device, see :meth:`microscope.devices.Device.call_oneway`.
+        If any of them fails, the first error is raised on the next
+        method call on this client.  Alternatively, use
+        :meth:`get_oneway_errors` to retrieve all errors.
+
+        .. code-block:: python
+
+            client.oneway.set_power_mw(10.0)
+            client.oneway.enable()
+            # Waits for the previous calls, raising their first error.
+            client.get_is_on()
+        """
+        return _OnewayCaller(self)
+
+    def _call_oneway(self, name, *args, **kwargs):
+        # Send the calls in order so that a sequence number is never
+        # skipped, which would stop all of our later calls.
+        with self._oneway_lock:
+            seq = self._oneway_seq +1
+            with self._checkout_proxy() as proxy:
+                if self._oneway_session is None:
+                    self._oneway_session = proxy.get_session_id()
+                proxy.call_oneway(self._client_id, seq, name, args, kwargs,
+                                  self._oneway_session)
+            self._oneway_seq = seq
+
+    def get_oneway_errors(self):
+        """Return and forget the errors of previous oneway calls.
+
+        Waits for all previous oneway calls to be made first.
+
+        Raises:
+            microscope.devices.OnewaySessionError: if the device
+                server restarted since the oneway calls were made.
+                Later oneway calls start a new session.
+            TimeoutError: if the device server gave up waiting for
+                the calls to be made.
+        """
+        with self._oneway_lock:
+            seq = self._oneway_seq
+            session = self._oneway_session
+        try:
+            with self._checkout_proxy() as proxy:
+                errors = proxy.drain_oneway_errors(self._client_id, seq,
+                                                   session)
+        except microscope.devices.OnewaySessionError:
+            with self._oneway_lock:
+                if self._oneway_session == session:
+                    self._oneway_session = None
+                    self._oneway_seq = 0
+                    self._oneway_drained_seq = 0
+            raise
+        with self._oneway_lock:
+            if self._oneway_session == session:
+                self._oneway_drained_seq = max(self._oneway_drained_seq,
+                                               seq)
+        return errors
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager to make multiple calls in one round trip.
 
-        # Derived classes may over-ride some methods. Leave these alone.
-        my_methods = [m[0] for m in inspect.getmembers(self, predicate=inspect.ismethod)]
-        methods = set(self._proxy._pyroMethods).difference(my_methods)
-        # But in the case of propertyes, we need to inspect the class.
-        my_properties = [m[0] for m in inspect.getmembers(self.__class__, predicate=inspect.isdatadescriptor)]
-        properties = set(self._proxy._pyroAttrs).difference(my_properties)
+        Method calls on the returned object are recorded and only
+        made on exit, all together, with
+        :meth:`microscope.devices.Device.call_many`.  Each recorded
+        call returns a :class:`concurrent.futures.Future` for its
+        result.  After all calls are made, the exception of the first
+        failed call, if any, is raised.  If the block raises an
+        exception, no call is made.
 
-        for attr in itertools.chain(methods, properties):
-            setattr(self, attr, getattr(self._proxy, attr))
+        .. code-block:: python
+
+            with laser.batch() as batch:
+                batch.set_power_mw(10.0)
+                power = batch.get_power_mw()
+            print(power.result())
+        """
+        recorder = _CallRecorder()
+        try:
+            yield recorder
+        except BaseException:
+            for future in recorder.futures:
+                future.cancel()
+            raise
+        if not recorder.calls:
+            return
+        results = self._call('call_many', recorder.calls)
+        first_error = None
+        for future, (result, error) in zip(recorder.futures, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+                if first_error is None:
+                    first_error = error
+        if first_error is not None:
+            raise first_error
+
+    def _update_metadata(self):
+        """Get metadata from the remote object and cache it.
+
+        Proxies in the pool are given the new metadata the next time
+        they are checked out.
+        """
+        with self._checkout_proxy() as proxy:
+            # Either connects, and gets the metadata with the
+            # handshake, or asks the connected remote for it.
+            proxy._pyroGetMetadata()
+            metadata = {
+                'methods': set(proxy._pyroMethods),
+                'oneway': set(proxy._pyroOneway),
+                'attrs': set(proxy._pyroAttrs),
+            }
+        _METADATA_CACHE[Pyro4.URI(self._url).object] = metadata
+        self._metadata = metadata
+        self._metadata_gen += 1
+        self._fresh_metadata = True
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails.  Pyro never exposes
+        # private names so don't even try, which also avoids
+        # recursion before _metadata is set.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if (name not in self._metadata['methods']
+                and name not in self._metadata['attrs']
+                and not self._fresh_metadata):
+            self._update_metadata()
+        if name in self._metadata['methods']:
+            method = functools.partial(self._call, name)
+            setattr(self, name, method)
+            return method
+        elif name in self._metadata['attrs']:
+            with self._checkout_proxy() as proxy:
+                return getattr(proxy, name)
+        raise AttributeError("remote object '%s' has no attribute '%s'"
+                             % (self._url, name))
+
+    def __setattr__(self, name, value):
+        if (not name.startswith('_')
+                and not hasattr(type(self), name)
+                and name in self._metadata['attrs']):
+            with self._checkout_proxy() as proxy:
+                setattr(proxy, name, value)
+        else:
+            super().__setattr__(name, value)
+
+
+class ClientGroup:
+    """Clients of multiple devices, to call them all at once.
+
+    Calls are made on all devices concurrently, each on its own
+    thread, so that operations on a whole microscope, such as making
+    all devices safe, take the time of the slowest device instead of
+    the time of all devices together.
+
+    Results are returned as a dict of URIs to ``(result, error)``
+    tuples, like :meth:`microscope.devices.Device.call_many`.  A
+    device that does not reply in time fails with
+    :class:`Pyro4.errors.TimeoutError` without delaying the others.
+    A device that can't be reached fails with the connection error,
+    and connection is tried again on the next call.
+
+    .. code-block:: python
+
+        group = ClientGroup(uris, timeout=0.5)
+        for uri, (result, error) in group.make_safe().items():
+            if error is not None:
+                print('failed to make %s safe: %s' % (uri, error))
+
+    Args:
+        uris (list): URIs of the devices.
+        timeout (float or dict): seconds to wait for a device to
+            reply, or a dict of URIs to the timeout of each device.
+            The dict must have the timeout of all devices.
+    """
+    def __init__(self, uris, timeout=1.0):
+        self._uris = [str(uri) for uri in uris]
+        if isinstance(timeout, dict):
+            self._timeouts = {str(uri): t for uri, t in timeout.items()}
+            missing = [uri for uri in self._uris if uri not in self._timeouts]
+            if missing:
+                raise ValueError('no timeout for devices %s'
+                                 % ', '.join(missing))
+        else:
+            self._timeouts = {uri: timeout for uri in self._uris}
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(self._uris), 1))
+        # Connect now so that the first calls, which may be urgent,
+        # don't wait for it.
+        concurrent.futures.wait([self._executor.submit(self._get_client, uri)
+                                 for uri in self._uris])
+
+    @property
+    def uris(self):
+        return list(self._uris)
+
+    def _get_client(self, uri):
+        client = self._clients.get(uri)
+        if client is None:
+            client = Client(uri, timeout=self._timeouts[uri])
+            with self._clients_lock:
+                client = self._clients.setdefault(uri, client)
+        return client
+
+    def _call_one(self, uri, name, args, kwargs):
+        try:
+            client = self._get_client(uri)
+            return (getattr(client, name)(*args, **kwargs), None)
+        except Exception as e:
+            return (None, e)
+
+    def call_each(self, calls):
+        """Make a different call on each device, all at once.
+
+        Args:
+            calls (dict): URIs of the devices to tuples of method
+                name, list of positional arguments, and dict of
+                keyword arguments.
+
+        Returns:
+            A dict of URIs to ``(result, error)`` tuples.
+        """
+        futures = {str(uri): self._executor.submit(self._call_one, str(uri),
+                                                   name, args, kwargs)
+                   for uri, (name, args, kwargs) in calls.items()}
+        return {uri: future.result() for uri, future in futures.items()}
+
+    def call(self, name, *args, **kwargs):
+        """Call the same method, with the same arguments, on all devices.
+
+        Returns:
+            A dict of URIs to ``(result, error)`` tuples.
+        """
+        return self.call_each({uri: (name, args, kwargs)
+                               for uri in self._uris})
+
+    def make_safe(self):
+        """Put all devices into a safe state."""
+        return self.call('make_safe')
+
+    def enable(self):
+        """Enable all devices."""
+        return self.call('enable')
+
+    def disable(self):
+        """Disable all devices."""
+        return self.call('disable')
+
+    def get_all_settings(self):
+        """Read the settings of all devices."""
+        return self.call('get_all_settings')
+
+    def close(self):
+        """Stop the threads making the calls."""
+        self._executor.shutdown(wait=False)
+
+
+def _unix_socket_dir():
+    """Directory, private to this user, for the unix sockets."""
+    return os.path.join(tempfile.gettempdir(), 'microscope-%d' % os.getuid())
+
+
+def _unix_socket_path(host, port):
+    """Path of the unix socket of a device served on host and port.
+
+    See the `unix_socket` argument of :func:`microscope.devices.device`.
+    """
+    return os.path.join(_unix_socket_dir(),
+                        'microscope-%s-%d.sock' % (host, port))
+
+
+def _prefer_unix_socket(url, timeout=None):
+    """URI on the unix socket of the same object, if it is reachable.
+
+    A device server on this computer may also serve its device on a
+    unix socket, which has lower latency than TCP.  Otherwise, or if
+    the socket is left over from a dead server, or does not reply
+    within `timeout` seconds, return `url`.  Only sockets created by
+    this user are used, so that other users can't impersonate the
+    device.  URIs other than ``PYRO`` URIs with a port, e.g.,
+    ``PYRONAME`` URIs, are returned unchanged.
+    """
+    uri = Pyro4.URI(url)
+    if (uri.protocol != 'PYRO' or uri.port is None or uri.sockname
+            or not hasattr(socket, 'AF_UNIX')):
+        return url
+    path = _unix_socket_path(uri.host, uri.port)
+    try:
+        path_stat = os.lstat(path)
+    except OSError:
+        return url
+    if (not stat.S_ISSOCK(path_stat.st_mode)
+            or path_stat.st_uid != os.getuid()):
+        return url
+    unix_url = 'PYRO:%s@./u:%s' % (uri.object, path)
+    proxy = Pyro4.Proxy(unix_url)
+    # A hung server still accepts the connection, so the handshake
+    # must not wait longer than the calls of the client would.
+    proxy._pyroTimeout = timeout
+    try:
+        proxy._pyroBind()
+    except Pyro4.errors.PyroError:
+        return url
+    finally:
+        proxy._pyroRelease()
+    return unix_url
+
+
+def _local_address_to(host):
+    """IP address of the local interface that routes to host."""
+    if host in ['127.0.0.1', 'localhost']:
+        return '127.0.0.1'
+    try:
+        # Connecting a UDP socket sends nothing, it only selects the
+        # route, and so the local interface, to the host.
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect((host, 9))
+            return sock.getsockname()[0]
+    except OSError:
+        return socket.gethostbyname(socket.gethostname())
+
+
+def _start_listener(iface, servertype=None):
+    """Start a Pyro daemon, on its own thread, to receive data."""
+    if servertype is None:
+        daemon = Pyro4.Daemon(host=iface)
+    else:
+        # The server type is only read when the daemon is created.
+        default_servertype = Pyro4.config.SERVERTYPE
+        Pyro4.config.SERVERTYPE = servertype
+        try:
+            daemon = Pyro4.Daemon(host=iface)
+        finally:
+            Pyro4.config.SERVERTYPE = default_servertype
+    lthread = threading.Thread(target=daemon.requestLoop)
+    lthread.daemon = True
+    lthread.start()
+    return daemon
 
 
 class DataClient(Client):
-    """A client that can receive and buffer data."""
-    def __init__(self, url):
+    """A client that can receive and buffer data.
+
+    Data is received by a Pyro daemon, a listener, on the local
+    interface that routes to the device host.  Clients share one
+    listener per interface unless `dedicated_listener` is set, which
+    isolates high-bandwidth streams.  Listeners use one thread per
+    sending device, from a thread pool whose size is set for the
+    whole process by Pyro's ``THREADPOOL_SIZE`` and
+    ``THREADPOOL_SIZE_MIN`` config items.
+
+    Args:
+        url (str): URI of the remote device.
+        iface (str): IP address of the local interface to receive
+            data.  Defaults to the interface that routes to the
+            device host.
+        dedicated_listener (bool): whether to receive data on a new
+            listener used only by this client.  Call :meth:`close`
+            to stop it.
+        servertype (str): Pyro server type, ``'thread'`` or
+            ``'multiplex'``, of the listener if a new one is needed.
+    """
+    def __init__(self, url, iface=None, dedicated_listener=False,
+                 servertype=None):
         super().__init__(url)
         self._buffer = queue.Queue()
+        if iface is None:
+            uri = Pyro4.URI(self._url)
+            if uri.sockname:
+                # Connected via unix socket so on this computer.
+                iface = '127.0.0.1'
+            else:
+                iface = _local_address_to(uri.host)
         # Register self with a listener.
-        if self._url.split('@')[1].split(':')[0] in ['127.0.0.1', 'localhost']:
-            iface = '127.0.0.1'
+        if dedicated_listener:
+            self._listener = _start_listener(iface, servertype)
+            self._dedicated_listener = True
+        else:
+            if iface not in LISTENERS:
+                LISTENERS[iface] = _start_listener(iface, servertype)
+            self._listener = LISTENERS[iface]
+            self._dedicated_listener = False
+        self._client_uri = self._listener.register(self)
+
+    def close(self):
+        """Stop receiving data, shutting down a dedicated listener."""
+        if self._dedicated_listener:
+            self._listener.shutdown()
         else:
-            # TODO: support multiple interfaces. Could use ifaddr.get_adapters() to
-            # query ip addresses then pick first interface on the same subnet.
-            iface = socket.gethostbyname(socket.gethostname())
-        if iface not in LISTENERS:
-            LISTENERS[iface] = Pyro4.Daemon(host=iface)
-            lthread = threading.Thread(target=LISTENERS[iface].requestLoop)
-            lthread.daemon = True
-            lthread.start()
-        self._client_uri = LISTENERS[iface].register(self)
+            self._listener.unregister(self)
 
     def enable(self):
         """Set the client on the remote and enable it."""
         self.set_client(self._client_uri)
-        self._proxy.enable()
+        self._call('enable')
 
 
     @Pyro4.expose
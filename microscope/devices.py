@@ -25,14 +25,19 @@ device may be served from a separate process, or even from a different PC.
 """
 
 import abc
+import concurrent.futures
 import contextlib
 import functools
 import itertools
+import json
 import logging
+import os
 import queue
+import socket
 import threading
 import time
 import typing
+import uuid
 
 from ast import literal_eval
 from collections import OrderedDict, namedtuple
@@ -42,10 +47,38 @@ from enum import Enum, EnumMeta
 import numpy
 import Pyro4
 
+import microscope._serializer
+
 
 _logger = logging.getLogger(__name__)
 
 
+class OnewaySessionError(Exception):
+    """The device server restarted since a client made oneway calls.
+
+    The errors of those calls, and possibly some of the calls, were
+    lost.  See :meth:`Device.drain_oneway_errors`.
+    """
+    pass
+
+
+class ProfileError(Exception):
+    """Some settings of a profile could not be restored.
+
+    All other settings of the profile were restored.  See
+    :meth:`Device.load_profile`.
+
+    Attributes:
+        failed (list): names of the settings not restored.
+        results (dict): value read back of the settings restored.
+    """
+    def __init__(self, failed, results):
+        super().__init__('failed to restore settings: %s'
+                         % ', '.join(failed))
+        self.failed = failed
+        self.results = results
+
+
 # A tuple that defines a region of interest.
 ROI = namedtuple('ROI', ['left', 'top', 'width', 'height'])
 # A tuple containing parameters for horizontal and vertical binning.
@@ -69,6 +102,23 @@ DTYPES = {
 }
 
 
+class _TimedOut:
+    """Type of the :data:`TIMED_OUT` sentinel.
+
+    Pickled by reference so that the sentinel keeps its identity when
+    sent over Pyro, i.e., ``value is TIMED_OUT`` works on the client.
+    """
+    def __reduce__(self):
+        return 'TIMED_OUT'
+
+    def __repr__(self):
+        return 'TIMED_OUT'
+
+# Value reported by `Device.get_all_settings` for settings whose getter
+# did not return in time.
+TIMED_OUT = _TimedOut()
+
+
 def _call_if_callable(f):
     """Call callables, or return value of non-callables."""
     return f() if callable(f) else f
@@ -164,21 +214,62 @@ class _Setting():
                 return values
 
 
-def device(cls, host, port, conf={}, uid=None):
+def device(cls, host, port, conf={}, uid=None, profile=None, group=None,
+           retry_policy=None, pyro_config=None, unix_socket=False):
     """Define a device and where to serve it.
 
     A device definition for use in deviceserver config files.
 
     Args:
-        cls (type): type/class of device to serve.
+        cls (type or str): type/class of device to serve, or its
+            import path, e.g., ``'microscope.cameras.pvcam.PVCamera'``.
+            Classes given by their import path are only imported on
+            the process serving the device, which avoids loading
+            vendor libraries on processes that do not use them.
+            However, if such class is a floating device, it must be
+            defined with a `uid`.
         host (str): hostname or ip address serving the device.
         port (int): port number used to serve the device.
         conf (dict): keyword arguments to construct the device.  The
             device is effectively constructed with `cls(**conf)`.
         uid (str): used to identify "floating" devices (see
             documentation for :class:`FloatingDeviceMixin`)
+        profile (str): path to a settings profile, as saved by
+            :meth:`Device.save_profile`.  If the file exists, it is
+            restored every time the device is (re)started.
+        group (str): name of a group of devices to serve from a single
+            process.  By default, each device is served from its own
+            process.  See :class:`microscope.deviceserver.DeviceGroupServer`.
+        retry_policy (microscope.deviceserver.RetryPolicy): how to
+            retry if the device fails to initialise.  Defaults to
+            :data:`microscope.deviceserver.DEFAULT_RETRY_POLICY`.
+        pyro_config (dict): Pyro configuration items for the process
+            serving the device, e.g., ``{'THREADPOOL_SIZE': 200}``.
+            Useful to tune the server are ``THREADPOOL_SIZE``,
+            ``THREADPOOL_SIZE_MIN``, ``SERVERTYPE``, ``SOCK_NODELAY``,
+            ``COMMTIMEOUT``, and ``MAX_MESSAGE_SIZE``.  See Pyro's
+            documentation for their meaning.  Devices in the same
+            group share one configuration.
+        unix_socket (bool or str): whether to also serve the device on
+            a unix domain socket, for lower latency to clients on the
+            same computer.  If `True`, the socket is on a path derived
+            from `host` and `port`, on a directory private to the
+            user, and :class:`microscope.clients.Client` uses it
+            automatically when run by the same user.  If a path,
+            clients must use the ``PYRO:<object>@./u:<path>`` URI.
+            Not supported on Windows.
     """
-    return dict(cls=cls, host=host, port=int(port), uid=uid, conf=conf)
+    if unix_socket and not hasattr(socket, 'AF_UNIX'):
+        raise ValueError('unix domain sockets are not supported on this'
+                         ' platform')
+    if pyro_config is not None:
+        unknown = set(pyro_config.keys()) - set(Pyro4.config.asDict().keys())
+        if unknown:
+            raise ValueError('unknown Pyro config items: %s'
+                             % ', '.join(sorted(unknown)))
+    return dict(cls=cls, host=host, port=int(port), uid=uid, conf=conf,
+                profile=profile, group=group, retry_policy=retry_policy,
+                pyro_config=pyro_config, unix_socket=unix_socket)
 
 
 class FloatingDeviceMixin(metaclass=abc.ABCMeta):
@@ -204,11 +295,37 @@ class Device(metaclass=abc.ABCMeta):
             This argument is added by the deviceserver.
     """
 
+    # Maximum number of threads used to read settings concurrently
+    # when get_all_settings is called with a timeout.
+    _settings_max_workers = 4
+    # Seconds that a oneway call waits for the previous calls of the
+    # same client, and that drain_oneway_errors waits for the calls
+    # to be made.
+    _oneway_timeout = 30.0
+    # Seconds after which the oneway state of an idle client is
+    # forgotten.  Clients do not say when they go away.
+    _oneway_client_expiry = 3600.0
+
     def __init__(self, index=None):
         self.enabled = None
         # A list of settings. (Can't serialize OrderedDict, so use {}.)
         self._settings = OrderedDict()
         self._index = index
+        # Thread pool for get_all_settings, only created if needed,
+        # and the last read of each group of settings.
+        self._settings_executor = None
+        self._settings_reads = {}
+        # For get_server_stats.
+        self._start_time = time.monotonic()
+        # For call_oneway, per client id, the sequence number of the
+        # last call made, the errors not yet drained, and the time of
+        # its last oneway activity.  The session id identifies this
+        # instance so that clients notice a restarted server.
+        self._session_id = uuid.uuid4().hex
+        self._oneway_condition = threading.Condition()
+        self._oneway_last_seq = {}
+        self._oneway_errors = {}
+        self._oneway_last_used = {}
 
     def __del__(self):
         self.shutdown()
@@ -262,12 +379,179 @@ class Device(metaclass=abc.ABCMeta):
             _logger.warning("Exception in disable() during shutdown: %s", e)
         _logger.info("Shutting down ... ... ...")
         self._on_shutdown()
+        self._stop_settings_executor()
         _logger.info("... ... ... ... shut down completed.")
 
+    def _stop_settings_executor(self):
+        """Stop the threads of get_all_settings, without waiting."""
+        # May be called from __del__ on a partially initialised device.
+        executor = getattr(self, '_settings_executor', None)
+        if executor is not None:
+            self._settings_executor = None
+            executor.shutdown(wait=False)
+
     def make_safe(self):
         """Put the device into a safe state."""
         pass
 
+    def ping(self):
+        """Do nothing, quickly.
+
+        Used to check that the device server is responsive and to
+        measure latency without communicating with the hardware.  See
+        :func:`microscope.clients.ping_devices`.
+        """
+        return True
+
+    def get_server_stats(self):
+        """Return statistics of the process serving the device.
+
+        Like :meth:`ping`, this does not communicate with the
+        hardware.  Returns a dict with the keys:
+
+        ``pid``
+            process id.
+        ``uptime``
+            seconds since the device was constructed.
+        ``cpu_time``
+            CPU seconds used by the process.
+        ``threads``
+            number of live threads on the process.
+        """
+        return {
+            'pid': os.getpid(),
+            'uptime': time.monotonic() - self._start_time,
+            'cpu_time': time.process_time(),
+            'threads': threading.active_count(),
+        }
+
+    def _call_by_name(self, name, args, kwargs):
+        # Like Pyro, do not allow calls to private methods.
+        if name.startswith('_'):
+            raise AttributeError("'%s' is private" % name)
+        return getattr(self, name)(*args, **kwargs)
+
+    def call_many(self, calls):
+        """Call multiple methods of the device, in order.
+
+        This saves the round trip of each call to a remote device.
+        See :meth:`microscope.clients.Client.batch`.
+
+        Args:
+            calls (list): sequence of ``(name, args, kwargs)`` tuples,
+                one for each method call.
+
+        Returns:
+            A list with one ``(result, error)`` tuple per call.  If a
+            call raises an exception, its `error` is the exception,
+            and the following calls are still made.  Otherwise,
+            `error` is `None`.
+        """
+        results = []
+        for name, args, kwargs in calls:
+            try:
+                results.append((self._call_by_name(name, args, kwargs), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def get_session_id(self):
+        """Return an id unique to this instance of the device.
+
+        A device server that restarts gets a new session id.  See
+        :meth:`call_oneway`.
+        """
+        return self._session_id
+
+    def _prune_oneway_clients(self):
+        # Called with _oneway_condition held.
+        now = time.monotonic()
+        for client_id, last_used in list(self._oneway_last_used.items()):
+            if now - last_used > self._oneway_client_expiry:
+                del self._oneway_last_used[client_id]
+                self._oneway_last_seq.pop(client_id, None)
+                self._oneway_errors.pop(client_id, None)
+
+    @Pyro4.oneway
+    def call_oneway(self, client_id, seq, name, args, kwargs,
+                    session_id=None):
+        """Call a method without the caller waiting for it.
+
+        Used by :attr:`microscope.clients.Client.oneway`.  Pyro makes
+        each oneway call on a new thread so they can start out of
+        order.  The calls of each client are made in the order of
+        their sequence number `seq`, starting at 1.  Exceptions are
+        kept until retrieved with :meth:`drain_oneway_errors`.
+
+        A call that waits more than ``_oneway_timeout`` seconds for
+        the previous calls, or that arrives after a later call, is
+        not made and a `TimeoutError` is kept in its place.  Calls
+        with a `session_id` other than :meth:`get_session_id` were
+        numbered for a previous server and are dropped.
+        """
+        with self._oneway_condition:
+            self._prune_oneway_clients()
+            self._oneway_last_used[client_id] = time.monotonic()
+            if session_id is not None and session_id != self._session_id:
+                _logger.warning("dropping oneway call to '%s' made to a"
+                                " previous device server", name)
+                return
+            in_order = self._oneway_condition.wait_for(
+                lambda: self._oneway_last_seq.get(client_id, 0) >= seq -1,
+                timeout=self._oneway_timeout)
+            last_seq = self._oneway_last_seq.get(client_id, 0)
+            if not in_order or last_seq >= seq:
+                error = TimeoutError("oneway call %d to '%s' not made:"
+                                     " waited %g seconds for the previous"
+                                     " calls" % (seq, name,
+                                                 self._oneway_timeout))
+                _logger.error("%s", error)
+                self._oneway_errors.setdefault(client_id, []).append(error)
+                self._oneway_last_seq[client_id] = max(last_seq, seq)
+                self._oneway_condition.notify_all()
+                return
+        try:
+            self._call_by_name(name, args, kwargs)
+        except Exception as e:
+            _logger.debug("oneway call to '%s' failed", name, exc_info=e)
+            error = e
+        else:
+            error = None
+        with self._oneway_condition:
+            if error is not None:
+                self._oneway_errors.setdefault(client_id, []).append(error)
+            self._oneway_last_seq[client_id] = seq
+            self._oneway_last_used[client_id] = time.monotonic()
+            self._oneway_condition.notify_all()
+
+    def drain_oneway_errors(self, client_id, seq, session_id=None):
+        """Return and forget the errors of a client oneway calls.
+
+        Waits for the client calls up to sequence number `seq` to be
+        made first.  See :meth:`call_oneway`.
+
+        Raises:
+            OnewaySessionError: if `session_id` is not the id of this
+                server session, i.e., the server restarted since the
+                calls were made.
+            TimeoutError: if the calls are not made within
+                ``_oneway_timeout`` seconds.
+        """
+        with self._oneway_condition:
+            if session_id is not None and session_id != self._session_id:
+                raise OnewaySessionError("device server restarted, the"
+                                         " errors of previous oneway calls"
+                                         " were lost")
+            self._prune_oneway_clients()
+            self._oneway_last_used[client_id] = time.monotonic()
+            if not self._oneway_condition.wait_for(
+                    lambda: self._oneway_last_seq.get(client_id, 0) >= seq,
+                    timeout=self._oneway_timeout):
+                raise TimeoutError("timed out after %g seconds waiting for"
+                                   " oneway call %d to be made"
+                                   % (self._oneway_timeout, seq))
+            return self._oneway_errors.pop(client_id, [])
+
     def add_setting(self, name, dtype, get_func, set_func, values,
                     readonly=False):
         """Add a setting definition.
@@ -307,8 +591,20 @@ class Device(metaclass=abc.ABCMeta):
             _logger.error("in get_setting(%s):", name, exc_info=err)
             raise
 
-    def get_all_settings(self):
-        """Return ordered settings as a list of dicts."""
+    def get_all_settings(self, timeout=None):
+        """Return ordered settings as a list of dicts.
+
+        Args:
+            timeout (float): if `None`, the default, settings are read
+                one at a time.  Otherwise, independent settings are
+                read concurrently and those not read within `timeout`
+                seconds are reported as :data:`TIMED_OUT`.  Settings
+                that share a communication channel are still read one
+                at a time (see :meth:`_get_settings_groups`).  Groups
+                of settings whose read from a previous call is still
+                running are not read again, and are reported as
+                :data:`TIMED_OUT`, until that read finishes.
+        """
         # Fetching some settings may fail depending on device state.
         # Report these values as 'None' and continue fetching other settings.
         def catch(f):
@@ -317,7 +613,56 @@ class Device(metaclass=abc.ABCMeta):
             except Exception as err:
                 _logger.error("getting %s: %s", f.__self__.name, err)
                 return None
-        return {k: catch(v.get) for k, v in self._settings.items()}
+
+        if timeout is None:
+            return {k: catch(v.get) for k, v in self._settings.items()}
+
+        results = {}
+        def read_group(names):
+            for name in names:
+                results[name] = catch(self._settings[name].get)
+
+        if self._settings_executor is None:
+            self._settings_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._settings_max_workers)
+        futures = []
+        n_skipped = 0
+        for names in self._get_settings_groups():
+            group = tuple(names)
+            previous = self._settings_reads.get(group)
+            if previous is not None and not previous.done():
+                # Its getter may be stuck for good.  Don't queue
+                # another read behind it.
+                n_skipped += 1
+                continue
+            future = self._settings_executor.submit(read_group, names)
+            self._settings_reads[group] = future
+            futures.append(future)
+        not_done = concurrent.futures.wait(futures, timeout=timeout).not_done
+        if not_done or n_skipped:
+            _logger.warning("%d group(s) of settings timed out after %ss",
+                            len(not_done) + n_skipped, timeout)
+        # Reads that have not started are dropped.  Those still
+        # running are left to finish, so the number of threads stays
+        # bounded even if a getter never returns.
+        for future in not_done:
+            future.cancel()
+        return {k: results.get(k, TIMED_OUT) for k in self._settings.keys()}
+
+    def _get_settings_groups(self):
+        """Return groups of settings that must be read one at a time.
+
+        Used by :meth:`get_all_settings` to decide what can be read
+        concurrently.  By default, all settings are independent,
+        except for devices with a `_comms_lock`, such as those using
+        :class:`SerialDeviceMixIn`, where all settings go through the
+        same channel and form a single group.  Subclasses can override
+        this for finer grouping.
+        """
+        if hasattr(self, '_comms_lock'):
+            return [list(self._settings.keys())]
+        else:
+            return [[k] for k in self._settings.keys()]
 
     def set_setting(self, name, value):
         """Set a setting."""
@@ -336,11 +681,15 @@ class Device(metaclass=abc.ABCMeta):
         return [(k, v.describe()) for (k, v) in self._settings.items()]
 
     def update_settings(self, incoming, init=False):
-        """Update settings based on dict of settings and values."""
+        """Update settings based on dict of settings and values.
+
+        Settings are updated in the order they were added to the
+        device, and their values are read back afterwards.
+        """
+        my_keys = set(self._settings.keys())
+        their_keys = set(incoming.keys())
         if init:
             # Assume nothing about state: set everything.
-            my_keys = set(self._settings.keys())
-            their_keys = set(incoming.keys())
             update_keys = my_keys & their_keys
             if update_keys != my_keys:
                 missing = ', '.join([k for k in my_keys - their_keys])
@@ -349,26 +698,169 @@ class Device(metaclass=abc.ABCMeta):
                 raise Exception(msg)
         else:
             # Only update changed values.
-            my_keys = set(self._settings.keys())
-            their_keys = set(incoming.keys())
             update_keys = set(key for key in my_keys & their_keys
                               if self.get_setting(key) != incoming[key])
         results = {}
         # Update values.
-        for key in update_keys:
-            if key not in my_keys or not self._settings[key].set:
-                # Setting not recognised or no set function implemented
+        update_keys = [k for k in self._settings.keys() if k in update_keys]
+        for key in list(update_keys):
+            setting = self._settings[key]
+            if setting._set is None:
+                # No set function implemented
                 results[key] = NotImplemented
                 update_keys.remove(key)
-                continue
-            if _call_if_callable(self._settings[key].readonly):
-                continue
-            self._settings[key].set(incoming[key])
+            elif not setting.readonly():
+                setting.set(incoming[key])
         # Read back values in second loop.
         for key in update_keys:
             results[key] = self._settings[key].get()
         return results
 
+    def get_profile(self):
+        """Return the current value of all writable settings.
+
+        The returned dict can be passed to :meth:`update_settings` to
+        restore this state later.  Settings whose value is unknown,
+        such as write-only settings that were never set, or that fail
+        to be read, are skipped.
+        """
+        profile = OrderedDict()
+        for name, setting in self._settings.items():
+            if setting._set is None or setting.readonly():
+                continue
+            try:
+                value = self.get_setting(name)
+            except Exception as err:
+                _logger.warning("not saving %s in profile: %s", name, err)
+                continue
+            if value is not None:
+                profile[name] = value
+        return profile
+
+    def save_profile(self, filepath):
+        """Save the current value of all writable settings to a file.
+
+        The file is replaced at once so that a failure to save never
+        leaves a truncated profile behind.  See :meth:`get_profile`
+        and :meth:`load_profile`.
+        """
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'w') as fh:
+            json.dump(self.get_profile(), fh, separators=(',', ':'),
+                      default=_profile_value_to_json)
+        os.replace(tmp_filepath, filepath)
+
+    def load_profile(self, filepath):
+        """Restore settings saved with :meth:`save_profile`.
+
+        Only settings that differ from their current value are set,
+        in the order they were added to the device.  Data devices
+        toggle acquisition once for the whole profile, not once per
+        setting.
+
+        A setting that fails to be restored, e.g., because the value
+        saved is no longer valid, does not stop the others from being
+        restored.  Failures are logged and, once all settings were
+        tried, :class:`ProfileError` is raised.
+
+        Returns:
+            A dict with the value read back of the settings restored.
+        """
+        with open(filepath, 'r') as fh:
+            profile = json.load(fh, object_pairs_hook=OrderedDict)
+        # JSON has no tuples, and tuple settings such as ROI and
+        # binning would otherwise always compare as changed.
+        for name, value in profile.items():
+            if isinstance(value, list):
+                profile[name] = tuple(value)
+        results, failed = self._restore_settings(profile)
+        if failed:
+            raise ProfileError(failed, results)
+        return results
+
+    def _restore_settings(self, profile):
+        """Set each setting of a profile, carrying on after failures.
+
+        Returns the value read back of the settings restored and the
+        names of the settings that failed.
+        """
+        results = {}
+        failed = []
+        for name, setting in self._settings.items():
+            if name not in profile:
+                continue
+            try:
+                if setting.get() == profile[name]:
+                    continue
+                if setting._set is None or setting.readonly():
+                    raise Exception('setting is not writable')
+                setting.set(profile[name])
+                results[name] = setting.get()
+            except Exception as err:
+                _logger.error("failed to restore setting %s", name,
+                              exc_info=err)
+                failed.append(name)
+        return results, failed
+
+
+def _profile_value_to_json(value):
+    """Convert setting values that json can't serialize."""
+    if isinstance(value, numpy.generic):
+        return value.item()
+    elif isinstance(value, numpy.ndarray):
+        return value.tolist()
+    elif isinstance(value, Enum):
+        return value.value
+    raise TypeError("setting value %r of type %s can't be saved in a profile"
+                    % (value, type(value).__name__))
+
+
+class RateLimitedLog:
+    """Log a message at most once every `interval` seconds.
+
+    For log calls on hot paths, such as once per frame, where logging
+    every message would slow down the device and flood the log files.
+    Messages that are not logged are counted, and their number is
+    appended to the next message logged.
+
+    .. code-block:: python
+
+        _log_frame = RateLimitedLog(_logger, logging.INFO, interval=5.0)
+
+        class SomeCamera(CameraDevice):
+            def _fetch_data(self):
+                ...
+                _log_frame("Fetched image with shape %s", data.shape)
+
+    Args:
+        logger (logging.Logger): logger for the messages.
+        level (int): level of the messages.
+        interval (float): minimum time, in seconds, between messages.
+    """
+    def __init__(self, logger, level, interval=1.0):
+        self._logger = logger
+        self._level = level
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._last_time = None
+        self._n_skipped = 0
+
+    def __call__(self, msg, *args, **kwargs):
+        if not self._logger.isEnabledFor(self._level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if (self._last_time is not None
+                    and now - self._last_time < self._interval):
+                self._n_skipped += 1
+                return
+            n_skipped = self._n_skipped
+            self._last_time = now
+            self._n_skipped = 0
+        if n_skipped:
+            msg = '%s (and %d similar messages)' % (msg, n_skipped)
+        self._logger.log(self._level, msg, *args, **kwargs)
+
 
 def keep_acquiring(func):
     """Wrapper to preserve acquiring state of data capture devices."""
@@ -420,6 +912,10 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         self._acquiring = False
         # A condition to signal arrival of a new data and unblock grab_next_data
         self._new_data_condition = threading.Condition()
+        # Errors on the fetch and dispatch loops tend to repeat for
+        # every frame.
+        self._log_fetch_error = RateLimitedLog(_logger, logging.ERROR)
+        self._log_dispatch_error = RateLimitedLog(_logger, logging.ERROR)
 
     def __del__(self):
         self.disable()
@@ -495,6 +991,16 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         """Do any data processing and return data."""
         return data
 
+    def _on_data_dispatched(self, data):
+        """Called after data from the dispatch buffer was handled.
+
+        Called whether the data was sent, failed to be sent, or
+        dropped because its client is gone.  Devices that put in the
+        dispatch buffer views of memory they reuse, instead of
+        copies, can use this to know when that memory is free.
+        """
+        pass
+
     def _send_data(self, client, data, timestamp):
         """Dispatch data to the client."""
         try:
@@ -517,6 +1023,7 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         while True:
             client, data, timestamp = self._dispatch_buffer.get(block=True)
             if client not in self._liveClients:
+                self._on_data_dispatched(data)
                 continue
             err = None
             if isinstance(data, Exception):
@@ -534,7 +1041,8 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
             if err:
                 # Raising an exception will kill the dispatch loop. We need
                 # another way to notify the client that there was a problem.
-                _logger.error("in _dispatch_loop:", exc_info=err)
+                self._log_dispatch_error("in _dispatch_loop:", exc_info=err)
+            self._on_data_dispatched(data)
             self._dispatch_buffer.task_done()
 
     def _fetch_loop(self):
@@ -545,7 +1053,7 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
             try:
                 data = self._fetch_data()
             except Exception as e:
-                _logger.error("in _fetch_loop:", exc_info=e)
+                self._log_fetch_error("in _fetch_loop:", exc_info=e)
                 # Raising an exception will kill the fetch loop. We need
                 # another way to notify the client that there was a problem.
                 timestamp = time.time()
@@ -594,7 +1102,12 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         """
         if new_client is not None:
             if isinstance(new_client, (str, Pyro4.core.URI)):
-                self._client = Pyro4.Proxy(new_client)
+                proxy = Pyro4.Proxy(new_client)
+                # Send data with the serializer the client used to
+                # reach us, its listener may not accept our default.
+                proxy._pyroSerializer = (
+                    microscope._serializer.serializer_of_current_call())
+                self._client = proxy
             else:
                 self._client = new_client
         else:
@@ -608,7 +1121,12 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
     @keep_acquiring
     def update_settings(self, settings, init=False):
         """Update settings, toggling acquisition if necessary."""
-        super().update_settings(settings, init)
+        return super().update_settings(settings, init)
+
+    @keep_acquiring
+    def _restore_settings(self, profile):
+        """Restore settings, toggling acquisition if necessary."""
+        return super()._restore_settings(profile)
 
     # noinspection PyPep8Naming
     def receiveClient(self, client_uri):
@@ -1149,11 +1667,27 @@ class ControllerDevice(Device, metaclass=abc.ABCMeta):
     This might require that controlled devices do nothing as part of
     their shutdown and initialisation.
 
+    Controlled devices are initialised one at a time.  Concrete
+    classes whose controlled devices are independent, e.g., do not
+    share a connection, can set `_initialize_concurrently` to
+    initialise them at the same time.
+
     """
+    _initialize_concurrently = False
+
     def initialize(self) -> None:
         super().initialize()
-        for d in self.devices.values():
-            d.initialize()
+        if not self._initialize_concurrently or len(self.devices) < 2:
+            for d in self.devices.values():
+                d.initialize()
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(self.devices)) as executor:
+                futures = [executor.submit(d.initialize)
+                           for d in self.devices.values()]
+            # Raise the first error, if any, after all are done.
+            for future in futures:
+                future.result()
 
     @property
     @abc.abstractmethod
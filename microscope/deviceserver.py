@@ -23,20 +23,33 @@ over Pyro. When called from the command line, this module will serve devices
 defined in a specified config file.
 """
 
+import argparse
 from collections.abc import Iterable
+import concurrent.futures
+import importlib
 import importlib.machinery
 import importlib.util
+import itertools
+import json
 import logging
 import multiprocessing
+import multiprocessing.connection as mp_connection
+import os.path
+import queue
 import signal
+import stat
 import sys
+import threading
 import time
+import typing
 from logging import StreamHandler
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from threading import Thread
 
 import Pyro4
 
+import microscope._serializer
+import microscope.clients
 import microscope.devices
 
 
@@ -50,9 +63,12 @@ if sys.platform == 'darwin' and sys.version_info < (3,8):
     multiprocessing = multiprocessing.get_context('spawn')
 
 
-# Pyro configuration. Use pickle because it can serialize numpy ndarrays.
+# Pyro configuration.  Use our pickle serializer with out-of-band
+# buffers because it can serialize numpy ndarrays without copies.
+# Also accept plain pickle for clients of older versions.
 Pyro4.config.SERIALIZERS_ACCEPTED.add('pickle')
-Pyro4.config.SERIALIZER = 'pickle'
+Pyro4.config.SERIALIZERS_ACCEPTED.add(microscope._serializer.NAME)
+Pyro4.config.SERIALIZER = microscope._serializer.NAME
 
 ## We effectively expose all attributes of the classes since our
 ## devices don't hold any private data.  The private methods are to
@@ -116,6 +132,146 @@ class Filter(logging.Filter):
             return False
 
 
+class _FilteredQueueListener(QueueListener):
+    """A QueueListener that runs a `Filter` on its own thread.
+
+    The filter runs once per record, before any handler, so that
+    handlers added later see the same records.
+    """
+    def __init__(self, queue, *handlers, **kwargs):
+        super().__init__(queue, *handlers, **kwargs)
+        self._filter = Filter()
+
+    def handle(self, record):
+        if self._filter.filter(record):
+            super().handle(record)
+
+
+class RetryPolicy(typing.NamedTuple('RetryPolicy',
+                                     [('delay', float),
+                                      ('factor', float),
+                                      ('max_delay', float),
+                                      ('first_delay', typing.Optional[float])])):
+    """How to retry a failed device initialisation.
+
+    The delay before each retry starts at `delay` seconds, and is
+    multiplied by `factor` after each retry up to `max_delay`
+    seconds.  If `first_delay` is not `None`, it is used as the delay
+    for the first retry only, e.g., for a quick retry of devices that
+    often fail the first time after a power cycle.
+
+    .. code-block:: python
+
+        # Retry after 0.1 seconds, then 1, 2, 4, 8, 10, 10, ...
+        device(SomeCamera, 'localhost', 8000,
+               retry_policy=RetryPolicy(delay=1, factor=2, max_delay=10,
+                                        first_delay=0.1))
+    """
+    def get_delay(self, attempt: int) -> float:
+        """Delay, in seconds, before retrying after `attempt` failures."""
+        if attempt == 1 and self.first_delay is not None:
+            return self.first_delay
+        if self.first_delay is not None:
+            attempt -= 1
+        return min(self.delay * (self.factor ** (attempt -1)),
+                   self.max_delay)
+
+# Retry after 1, 2, 4, then every 5 seconds.
+DEFAULT_RETRY_POLICY = RetryPolicy(delay=1.0, factor=2.0, max_delay=5.0,
+                                   first_delay=None)
+
+
+# Restart immediately, then after 1, 2, 4, up to 30 seconds.
+DEFAULT_RESTART_POLICY = RetryPolicy(delay=1.0, factor=2.0, max_delay=30.0,
+                                     first_delay=0.0)
+
+# Seconds a device server must run to no longer count previous
+# failures when it dies.
+_STABLE_RUN_TIME = 60.0
+
+# Exit code of a device server that failed to import its device
+# class.  Those are not restarted.
+_IMPORT_FAILED_EXITCODE = 3
+
+# Port of the NodeAgent of each node on a multi-node microscope.
+DEFAULT_AGENT_PORT = 8999
+
+
+class _IndexCache:
+    """Map of floating devices uid to their index, saved on a file.
+
+    Floating devices are only identified after initialisation so their
+    device server does not know which device it will get.  This keeps,
+    per class name, the index where each uid was found the last time.
+    It is shared between device servers, each of them updating it
+    with the device they found.
+    """
+    def __init__(self, filepath):
+        self._filepath = filepath
+        self._lock = multiprocessing.Lock()
+
+    def load(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        try:
+            with open(self._filepath, 'r') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, cls_name: str, uid: str, index: int) -> None:
+        with self._lock:
+            cache = self.load()
+            if cache.get(cls_name, {}).get(uid) == index:
+                return
+            cache.setdefault(cls_name, {})[uid] = index
+            tmp_filepath = self._filepath + '.tmp'
+            with open(tmp_filepath, 'w') as fh:
+                json.dump(cache, fh)
+            os.replace(tmp_filepath, self._filepath)
+
+
+def _assign_floating_indices(devs, cached) -> typing.List[int]:
+    """Index of each floating device definition.
+
+    Devices are given the index where their uid was last found, from
+    the `cached` map of uid to index.  The others are given the lowest
+    free indices.  Cached indices that are out of range, e.g., because
+    devices were removed from the config, or already taken by another
+    device are ignored.
+    """
+    indices = [None] * len(devs)
+    used = set()
+    for i, dev in enumerate(devs):
+        index = cached.get(dev['uid'])
+        if (isinstance(index, int) and 0 <= index < len(devs)
+                and index not in used):
+            indices[i] = index
+            used.add(index)
+    free = (i for i in itertools.count() if i not in used)
+    return [next(free) if index is None else index for index in indices]
+
+
+def _device_class_name(cls) -> str:
+    """Name of a device class, without importing it."""
+    if isinstance(cls, str):
+        return cls.rpartition('.')[2]
+    return cls.__name__
+
+
+def _import_device_class(cls) -> type:
+    """Return device class, importing it if given by its import path.
+
+    Device classes can be given by their import path, e.g.,
+    ``'microscope.cameras.pvcam.PVCamera'``, so that their modules,
+    which may load vendor libraries on import, are only imported on
+    the process serving them.
+    """
+    if not isinstance(cls, str):
+        return cls
+    module_name, _, cls_name = cls.rpartition('.')
+    module = importlib.import_module(module_name)
+    return getattr(module, cls_name)
+
+
 def _check_autoproxy_feature() -> None:
     # AUTOPROXY is enabled by default.  If it is disabled there must
     # be a reason so raise an error instead of silently enabling it.
@@ -135,24 +291,71 @@ def _check_autoproxy_feature() -> None:
     return None
 
 
-def _register_device(pyro_daemon, device, obj_id=None) -> None:
-    pyro_daemon.register(device, obj_id)
+def _apply_pyro_config(pyro_config) -> None:
+    """Set Pyro configuration items for this process.
+
+    Pyro reads most of its configuration at the time it is used, not
+    when the daemon is created, so this affects all daemons in the
+    process.
+    """
+    for name, value in pyro_config.items():
+        _logger.debug('Setting Pyro config %s to %r', name, value)
+        setattr(Pyro4.config, name, value)
+
+
+def _make_private_dir(path) -> None:
+    """Create directory only accessible to this user, if missing."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    dir_stat = os.lstat(path)
+    if (not stat.S_ISDIR(dir_stat.st_mode)
+            or dir_stat.st_uid != os.getuid()
+            or dir_stat.st_mode & 0o077):
+        raise RuntimeError("'%s' is not a directory private to this user"
+                           % path)
+
+
+def _remove_stale_socket(path) -> None:
+    """Remove unix socket left behind by a previous server that died.
+
+    Only sockets of this user are removed, never other files.
+    """
+    try:
+        path_stat = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if (not stat.S_ISSOCK(path_stat.st_mode)
+            or path_stat.st_uid != os.getuid()):
+        raise RuntimeError("'%s' exists and is not a socket of this user"
+                           % path)
+    os.remove(path)
+
+
+def _register_device(pyro_daemon, device, obj_id=None, again=False) -> None:
+    # If `again`, the device was already registered on another daemon
+    # so register it with the same id.  Pyro then creates autoproxies
+    # to the device on the daemon it was last registered.
+    if again:
+        pyro_daemon.register(device, device._pyroId, force=True)
+    else:
+        pyro_daemon.register(device, obj_id)
 
     if isinstance(device, microscope.devices.ControllerDevice):
         _check_autoproxy_feature()
         for sub_device in device.devices.values():
-            _register_device(pyro_daemon, sub_device, obj_id=None)
+            _register_device(pyro_daemon, sub_device, obj_id=None,
+                             again=again)
 
     if isinstance(device, microscope.devices.StageDevice):
         _check_autoproxy_feature()
         for axis in device.axes.values():
-            _register_device(pyro_daemon, axis, obj_id=None)
+            _register_device(pyro_daemon, axis, obj_id=None, again=again)
 
     return None
 
 
 class DeviceServer(multiprocessing.Process):
-    def __init__(self, device_def, id_to_host, id_to_port, exit_event=None):
+    def __init__(self, device_def, id_to_host, id_to_port, exit_event=None,
+                 index_cache=None):
         """Initialise a device and serve at host/port according to its id.
 
         :param device_def: definition of the device
@@ -160,6 +363,8 @@ class DeviceServer(multiprocessing.Process):
         :param id_to_port: map or mapping of device identifiers to port number
         :param exit_event: a shared event to signal that the process
             should quit.
+        :param index_cache: a shared `_IndexCache` to record the index
+            of floating devices.
         """
         # The device to serve.
         self._device_def = device_def
@@ -169,6 +374,9 @@ class DeviceServer(multiprocessing.Process):
         self._id_to_port = id_to_port
         # A shared event to allow clean shutdown.
         self.exit_event = exit_event
+        # An event to stop only this server, e.g., on config reload.
+        self._stop_event = multiprocessing.Event()
+        self._index_cache = index_cache
         super().__init__()
         self.daemon = True
 
@@ -178,11 +386,29 @@ class DeviceServer(multiprocessing.Process):
         This is useful to restart a device server.
         """
         return DeviceServer(self._device_def, self._id_to_host,
-                            self._id_to_port, exit_event=self.exit_event)
+                            self._id_to_port, exit_event=self.exit_event,
+                            index_cache=self._index_cache)
 
-    def run(self):
-        cls_name = self._device_def['cls'].__name__
+    def stop(self):
+        """Signal this server, and only this server, to quit."""
+        self._stop_event.set()
+
+    def _should_exit(self):
+        return (self._stop_event.is_set()
+                or (self.exit_event is not None and self.exit_event.is_set()))
+
+    def _setup_logging(self, name):
+        """Configure the root logger of this process to log to stderr.
 
+        The root logger only puts the log records on a queue.  The
+        handlers, which format the records and write them to stderr
+        and files, run on a separate thread so that logging never
+        blocks the device, e.g., on a slow disk.  Use
+        :meth:`_add_log_handler` to add handlers and
+        :meth:`_stop_logging` to flush them before exiting.
+
+        Returns the root logger.
+        """
         # If the multiprocessing start method is fork, the child
         # process gets a copy of the root logger.  The copy is
         # configured to sign the messages as "device-server", and
@@ -206,67 +432,488 @@ class DeviceServer(multiprocessing.Process):
         # don't have UIDs available until after initialization, so
         # log to stderr until then.
         stderr_handler = StreamHandler(sys.stderr)
-        stderr_handler.setFormatter(_create_log_formatter(cls_name))
-        root_logger.addHandler(stderr_handler)
+        stderr_handler.setFormatter(_create_log_formatter(name))
+
+        log_queue = queue.Queue()
+        root_logger.addHandler(QueueHandler(log_queue))
+        # Repeated messages are filtered on the logging thread too.
+        self._log_listener = _FilteredQueueListener(
+            log_queue, stderr_handler, respect_handler_level=True)
+        self._log_listener.start()
         root_logger.debug("Debugging messages on.")
+        return root_logger
+
+    def _add_log_handler(self, handler):
+        """Add handler to the thread handling the log records."""
+        self._log_listener.handlers = self._log_listener.handlers + (handler,)
+
+    def _stop_logging(self):
+        """Handle all queued log records and stop the logging thread."""
+        self._log_listener.stop()
+
+    def _import_device_class(self, device_def):
+        """Import class of device definition.
 
-        root_logger.addFilter(Filter())
+        Returns `None` and logs the error if it fails to import, e.g.,
+        because of a missing vendor library.
+        """
+        try:
+            return _import_device_class(device_def['cls'])
+        except Exception as e:
+            _logger.critical("Failed to import %s.  Not serving it.",
+                             device_def['cls'], exc_info=e)
+            return None
 
-        self._device = self._device_def['cls'](**self._device_def['conf'])
-        while not self.exit_event.is_set():
+    def _create_device(self, cls, device_def):
+        """Construct and initialise a device from its definition.
+
+        Initialisation is retried, according to the definition retry
+        policy, until it succeeds or the server is told to exit.  If the
+        definition has a settings profile, it is restored after
+        initialisation.
+        """
+        cls_name = cls.__name__
+        policy = device_def.get('retry_policy') or DEFAULT_RETRY_POLICY
+        start = time.monotonic()
+        device = cls(**device_def['conf'])
+        constructed = time.monotonic()
+
+        attempts = 0
+        while not self._should_exit():
+            attempts += 1
             try:
-                self._device.initialize()
+                device.initialize()
             except Exception as e:
-                _logger.info("Failed to start device. Retrying in 5s.",
-                             exc_info=e)
-                time.sleep(5)
+                delay = policy.get_delay(attempts)
+                _logger.info("Failed to start device. Retrying in %gs.",
+                             delay, exc_info=e)
+                time.sleep(delay)
             else:
                 break
+        initialized = time.monotonic()
+
+        profile = device_def.get('profile')
+        if profile is not None and os.path.exists(profile):
+            _logger.info("Restoring settings profile '%s'", profile)
+            try:
+                device.load_profile(profile)
+            except Exception as e:
+                _logger.error("Failed to restore settings profile '%s'",
+                              profile, exc_info=e)
+        done = time.monotonic()
+
+        _logger.info("%s started in %.3fs: construct %.3fs, initialize %.3fs"
+                     " (%d attempts), restore profile %.3fs", cls_name,
+                     done - start, constructed - start,
+                     initialized - constructed, attempts, done - initialized)
+        return device
+
+    def _start_daemon(self, device, host, port, unixsocket=None,
+                      again=False):
+        """Serve device on a new Pyro daemon running on its own thread.
+
+        The daemon listens on `unixsocket` if set, on `host` and
+        `port` otherwise.  Returns the daemon and the thread running
+        it.
+        """
+        cls_name = type(device).__name__
+        if unixsocket is None:
+            pyro_daemon = Pyro4.Daemon(port=port, host=host)
+        else:
+            _remove_stale_socket(unixsocket)
+            pyro_daemon = Pyro4.Daemon(unixsocket=unixsocket)
+        _register_device(pyro_daemon, device, obj_id=cls_name, again=again)
+
+        # Run the Pyro daemon in a separate thread so that we can do
+        # clean shutdown under Windows.
+        pyro_thread = Thread(target = pyro_daemon.requestLoop)
+        pyro_thread.daemon = True
+        pyro_thread.start()
+        _logger.info('Serving %s', pyro_daemon.uriFor(device))
+        return pyro_daemon, pyro_thread
+
+    def _start_daemons(self, device, device_def, host, port):
+        """Serve device on host and port, and on its unix socket if any.
+
+        Returns a list of the daemons and threads running them.
+        """
+        daemons = []
+        unix_socket = device_def.get('unix_socket')
+        if unix_socket:
+            if unix_socket is True:
+                _make_private_dir(microscope.clients._unix_socket_dir())
+                unix_socket = microscope.clients._unix_socket_path(host,
+                                                                   port)
+            daemons.append(self._start_daemon(device, None, None,
+                                              unixsocket=unix_socket))
+        # Register on TCP last, so that autoproxies of controlled
+        # devices can be used from other computers.
+        daemons.append(self._start_daemon(device, host, port,
+                                          again=bool(daemons)))
+        return daemons
+
+    def _stop_daemons(self, daemons):
+        for pyro_daemon, pyro_thread in daemons:
+            pyro_daemon.shutdown()
+            pyro_thread.join()
+
+    def _wait_for_exit(self):
+        # Wait for termination event. We should just be able to call
+        # wait() on the exit_event, but this causes issues with locks
+        # in multiprocessing - see http://bugs.python.org/issue30975 .
+        while self.exit_event and not self._should_exit():
+            # This tread waits for the termination event.
+            try:
+                time.sleep(1)
+            except (KeyboardInterrupt, IOError):
+                pass
+
+    def run(self):
+        cls_name = _device_class_name(self._device_def['cls'])
+        self._setup_logging(cls_name)
+        # Handle the log records still queued even if serving fails.
+        try:
+            self._serve()
+        finally:
+            self._stop_logging()
+
+    def _serve(self):
+        cls_name = _device_class_name(self._device_def['cls'])
+        _apply_pyro_config(self._device_def.get('pyro_config') or {})
+
+        cls = self._import_device_class(self._device_def)
+        if cls is None:
+            sys.exit(_IMPORT_FAILED_EXITCODE)
+        self._device = self._create_device(cls, self._device_def)
+
         if (isinstance(self._device, microscope.devices.FloatingDeviceMixin)
-            and len(self._id_to_host) > 1):
+            and self._id_to_host is not None and len(self._id_to_host) > 1):
             uid = str(self._device.get_id())
             if uid not in self._id_to_host or uid not in self._id_to_port:
                 raise Exception("Host or port not found for device %s" % (uid,))
+            if uid != self._device_def['uid']:
+                _logger.info("Expected device %s but found %s.  Serving"
+                             " it instead.", self._device_def['uid'], uid)
+            if self._index_cache is not None:
+                self._index_cache.update(cls_name, uid,
+                                         self._device_def['conf']['index'])
             host = self._id_to_host[uid]
             port = self._id_to_port[uid]
         else:
             host = self._device_def['host']
             port = self._device_def['port']
-        pyro_daemon = Pyro4.Daemon(port=port, host=host)
 
         log_handler = RotatingFileHandler('%s_%s_%s.log'
                                           % (cls_name, host, port))
         log_handler.setFormatter(_create_log_formatter(cls_name))
-        root_logger.addHandler(log_handler)
+        self._add_log_handler(log_handler)
 
         _logger.info('Device initialized; starting daemon.')
-        _register_device(pyro_daemon, self._device, obj_id=cls_name)
-
-        # Run the Pyro daemon in a separate thread so that we can do
-        # clean shutdown under Windows.
-        pyro_thread = Thread(target = pyro_daemon.requestLoop)
-        pyro_thread.daemon = True
-        pyro_thread.start()
-        _logger.info('Serving %s', pyro_daemon.uriFor(self._device))
+        daemons = self._start_daemons(self._device, self._device_def,
+                                      host, port)
         if isinstance(self._device, microscope.devices.FloatingDeviceMixin):
             _logger.info('Device UID on port %s is %s',
                          port, self._device.get_id())
 
-        # Wait for termination event. We should just be able to call
-        # wait() on the exit_event, but this causes issues with locks
-        # in multiprocessing - see http://bugs.python.org/issue30975 .
-        while self.exit_event and not self.exit_event.is_set():
-            # This tread waits for the termination event.
-            try:
-                time.sleep(5)
-            except (KeyboardInterrupt, IOError):
-                pass
-        pyro_daemon.shutdown()
-        pyro_thread.join()
+        self._wait_for_exit()
+        self._stop_daemons(daemons)
         self._device.shutdown()
 
 
-def serve_devices(devices, exit_event=None):
+class DeviceGroupServer(DeviceServer):
+    def __init__(self, name, device_defs, exit_event=None):
+        """Initialise and serve multiple devices in a single process.
+
+        Saves the memory and startup time of one Python interpreter
+        per device, which is worth it for light devices such as lasers
+        and filter wheels.  Each device is still served on its own
+        host and port so its URI is the same as if it was served on
+        its own process.  However, if one of the devices fails and
+        kills the process, all devices in the group are restarted.
+
+        :param name: name of the group, used for logging.
+        :param device_defs: definitions of the devices to serve.
+            Floating devices are not supported.
+        :param exit_event: a shared event to signal that the process
+            should quit.
+        """
+        self._name = name
+        self._device_defs = device_defs
+        self._devices = []
+        super().__init__(None, None, None, exit_event=exit_event)
+
+    def clone(self):
+        """Create new instance with same settings."""
+        return DeviceGroupServer(self._name, self._device_defs,
+                                 exit_event=self.exit_event)
+
+    def run(self):
+        self._setup_logging(self._name)
+        try:
+            self._serve()
+        finally:
+            self._stop_logging()
+
+    def _serve(self):
+        log_handler = RotatingFileHandler('%s.log' % self._name)
+        log_handler.setFormatter(_create_log_formatter(self._name))
+        self._add_log_handler(log_handler)
+
+        pyro_config = {}
+        for device_def in self._device_defs:
+            for name, value in (device_def.get('pyro_config') or {}).items():
+                if pyro_config.setdefault(name, value) != value:
+                    _logger.warning("Conflicting values for Pyro config %s"
+                                    " in group '%s'.  Using %r.", name,
+                                    self._name, pyro_config[name])
+        _apply_pyro_config(pyro_config)
+
+        # Each device is created on its own thread and served as soon
+        # as it is ready, so that a device that is slow to start, or
+        # that keeps failing to initialise, does not hold the others.
+        self._daemons = []
+        self._devices_lock = threading.Lock()
+        threads = [Thread(target=self._create_and_serve, args=(device_def,),
+                          daemon=True)
+                   for device_def in self._device_defs]
+        for thread in threads:
+            thread.start()
+
+        self._wait_for_exit()
+        for thread in threads:
+            thread.join()
+        self._stop_daemons(self._daemons)
+        for device in self._devices:
+            device.shutdown()
+
+    def _create_and_serve(self, device_def):
+        # A device that fails to import or construct does not stop
+        # the others in the group from being served.
+        cls = self._import_device_class(device_def)
+        if cls is None:
+            return
+        try:
+            device = self._create_device(cls, device_def)
+        except Exception as e:
+            _logger.critical("Failed to create %s.  Not serving it.",
+                             cls.__name__, exc_info=e)
+            return
+        with self._devices_lock:
+            self._devices.append(device)
+            if self._should_exit():
+                return
+            self._daemons.extend(self._start_daemons(device, device_def,
+                                                     device_def['host'],
+                                                     device_def['port']))
+
+
+def _create_servers(devices, exit_event, index_cache):
+    """Create, but not start, the servers for the device definitions.
+
+    Returns a dict mapping a key for each server, either
+    ``('device', host, port)`` or ``('group', name)``, to a tuple with
+    the server and the definitions it depends on.  When the device
+    definitions are reloaded, a server is only restarted if the
+    definitions it depends on have changed.
+    """
+    # Group devices by class.
+    by_class = {}
+    for dev in devices:
+        by_class[dev['cls']] = by_class.get(dev['cls'], []) + [dev]
+
+    cached_indices = {} if index_cache is None else index_cache.load()
+
+    servers = {}
+    # Devices to be served together, grouped by group name.
+    by_group = {}
+    for cls, devs in by_class.items():
+        # Each device of a class is given an index.  Some SDKs need
+        # this information to index devices.
+        if isinstance(cls, str):
+            # The class is only imported on the device server process
+            # so rely on floating devices being defined with a uid.
+            floating = any(dev['uid'] is not None for dev in devs)
+        else:
+            floating = issubclass(cls, microscope.devices.FloatingDeviceMixin)
+        if floating:
+            # Need to provide maps of uid to host and port.
+            uid_to_host = {}
+            uid_to_port = {}
+            for dev in devs:
+                uid = dev['uid']
+                uid_to_host[uid] = dev['host']
+                uid_to_port[uid] = dev['port']
+            indices = _assign_floating_indices(
+                devs, cached_indices.get(_device_class_name(cls), {}))
+        else:
+            uid_to_host = None
+            uid_to_port = None
+            indices = range(len(devs))
+
+        for dev, index in zip(devs, indices):
+            served_dev = dict(dev, conf=dict(dev['conf'], index=index))
+            group = dev.get('group')
+            if group is not None:
+                if uid_to_host is None:
+                    by_group.setdefault(group, []).append(served_dev)
+                    continue
+                _logger.warning("Floating device %s can't be served in group"
+                                " '%s'.  Serving on its own process.",
+                                _device_class_name(cls), group)
+            # Floating devices find their index at runtime, which is
+            # saved on the index cache, so they only depend on the
+            # definitions of their class.  Others also depend on the
+            # index given to them.
+            depends = devs if floating else [served_dev]
+            server = DeviceServer(served_dev, uid_to_host, uid_to_port,
+                                  exit_event=exit_event,
+                                  index_cache=index_cache)
+            servers[('device', dev['host'], dev['port'])] = (server, depends)
+
+    for group, devs in by_group.items():
+        server = DeviceGroupServer(group, devs, exit_event=exit_event)
+        servers[('group', group)] = (server, devs)
+    return servers
+
+
+def _device_uri(device_def) -> str:
+    """URI of a device defined with :func:`microscope.devices.device`."""
+    return 'PYRO:%s@%s:%d' % (_device_class_name(device_def['cls']),
+                              device_def['host'], device_def['port'])
+
+
+@Pyro4.expose
+class NodeAgent:
+    """Report the devices served on one node of a multi-node microscope.
+
+    A microscope may have devices attached to multiple computers.  If
+    the same config file, with the devices of all computers, is used
+    on each of them with the deviceserver ``--node`` option, each
+    computer serves only the devices defined for its host, and a
+    `NodeAgent` on port :data:`DEFAULT_AGENT_PORT` of that host.  All
+    computers start in parallel.  The agents report which of their
+    devices are ready and, by asking each other, the URIs of all
+    devices in the microscope with a single call::
+
+        agent = Pyro4.Proxy('PYRO:NodeAgent@192.168.0.2:8999')
+        registry = agent.get_registry()
+
+    Nodes are identified by the devices host so, to test with a single
+    computer, define the devices of each node on a different loopback
+    address, e.g., ``127.0.0.2`` and ``127.0.0.3``.
+    """
+    def __init__(self, devices, host, port=None):
+        self._host = host
+        self._port = DEFAULT_AGENT_PORT if port is None else port
+        self._devices = list(devices)
+
+    def _set_devices(self, devices):
+        """Set the definitions of all devices, e.g., on config reload."""
+        self._devices = list(devices)
+
+    def get_host(self) -> str:
+        return self._host
+
+    def get_status(self, timeout: float = 1.0) -> dict:
+        """Map of the URIs of the devices of this node to their readiness.
+
+        A device is ready if it replies to a ping within `timeout`
+        seconds.
+        """
+        uris = [_device_uri(d) for d in self._devices
+                if d['host'] == self._host]
+        if not uris:
+            return {}
+        report = microscope.clients.ping_devices(uris, count=1,
+                                                 timeout=timeout)
+        return {uri: stats['lost'] == 0 for uri, stats in report.items()}
+
+    def get_registry(self, timeout: float = 1.0) -> dict:
+        """Map of the URIs of the devices of all nodes to their readiness.
+
+        The agents of all nodes are asked at the same time.  Devices
+        of nodes whose agent does not reply are reported as not ready.
+        """
+        hosts = sorted({d['host'] for d in self._devices})
+        registry = {_device_uri(d): False for d in self._devices}
+        with concurrent.futures.ThreadPoolExecutor(len(hosts)) as executor:
+            for status in executor.map(self._get_node_status, hosts,
+                                       itertools.repeat(timeout)):
+                registry.update(status)
+        return registry
+
+    def _get_node_status(self, host, timeout):
+        if host == self._host:
+            return self.get_status(timeout)
+        proxy = Pyro4.Proxy('PYRO:NodeAgent@%s:%d' % (host, self._port))
+        # Give time for the agent to ping its devices.
+        proxy._pyroTimeout = 2 * timeout
+        try:
+            return proxy.get_status(timeout)
+        except Pyro4.errors.PyroError:
+            return {}
+        finally:
+            proxy._pyroRelease()
+
+
+def _same_definitions(defs1, defs2):
+    """Whether two lists of device definitions are the same."""
+    try:
+        return bool(defs1 == defs2)
+    except Exception:
+        # Comparison of some values, such as numpy arrays, can fail.
+        return False
+
+
+def serve_devices(devices, exit_event=None,
+                  restart_policy=DEFAULT_RESTART_POLICY, max_restarts=10,
+                  index_cache_file=None,
+                  config_file=None, node=None,
+                  agent_port=DEFAULT_AGENT_PORT):
+    """Serve devices, each on its own process, restarting those that die.
+
+    Floating devices, see
+    :class:`microscope.devices.FloatingDeviceMixin`, are only
+    identified after initialisation.  If `index_cache_file` is set,
+    the index where each was found is saved on it so that, the next
+    time, each device server opens the device it was defined for.  If
+    the devices were reconnected in a different order, each device
+    server serves the device it found instead, and the cache is
+    updated.
+
+    If `config_file` is set, the device definitions are reloaded from
+    it when it is modified or, on Unix, when the process receives
+    ``SIGHUP``.  Only the device servers whose definitions were added,
+    removed, or changed are started, stopped, or restarted.  The
+    others, such as a camera that took minutes to cool down, keep
+    running.  Servers that were given up on are restarted too.  If
+    the new config file has errors, the error is logged and the
+    running servers are left alone.
+
+    If `node` is set, `devices` are the devices of all computers in
+    a multi-node microscope but only those defined for the host
+    `node` are served.  A :class:`NodeAgent` is also served, on
+    `node` and `agent_port`, to report the devices ready.
+
+    Args:
+        devices (list): device definitions, see
+            :func:`microscope.devices.device`.
+        exit_event (multiprocessing.Event): event to signal the device
+            servers to exit.
+        restart_policy (RetryPolicy): delays before restarting a
+            device server that died.
+        max_restarts (int): maximum number of consecutive restarts of
+            a device server before giving up on it.
+        index_cache_file (str): path for the cache of floating devices
+            index.  If `None`, the index is not cached.
+        config_file (str): path for the config file with `devices`,
+            to reload them when it changes.  If `None`, the devices
+            are never reloaded.
+        node (str): host of this computer in a multi-node microscope.
+            If `None`, all devices are served.
+        agent_port (int): port for the :class:`NodeAgent` if `node`
+            is set.
+    """
     root_logger = logging.getLogger()
 
     log_handler = RotatingFileHandler("__MAIN__.log")
@@ -281,7 +928,14 @@ def serve_devices(devices, exit_event=None):
     if exit_event is None:
         exit_event = multiprocessing.Event()
 
-    servers = [] # DeviceServers instances that we need to wait for when exiting
+    # Map of server keys to the DeviceServers instances that we need
+    # to wait for when exiting, and their definitions.
+    servers = {}
+    # Servers told to stop after reloading the definitions.
+    stopping = []
+
+    # Set to reload the device definitions from config_file.
+    reload_event = threading.Event()
 
     ## Child processes inherit signal handling from the parent so we
     ## need to make sure that only the parent process sets the exit
@@ -294,107 +948,227 @@ def serve_devices(devices, exit_event=None):
         if parent == multiprocessing.current_process ():
             _logger.debug("Shutting down all servers.")
             exit_event.set()
-            # Join keep_alive_thread so that it can't modify the list
+            # Join supervisor_thread so that it can't modify the list
             # of servers.
-            keep_alive_thread.join()
-            for this_server in servers:
+            supervisor_thread.join()
+            for this_server, depends in servers.values():
+                this_server.join()
+            for this_server in stopping:
                 this_server.join()
             sys.exit()
 
+    def hup_func(sig, frame):
+        """Reload the device definitions."""
+        if parent == multiprocessing.current_process ():
+            reload_event.set()
+
     if sys.platform != 'win32':
         signal.signal(signal.SIGTERM, term_func)
         signal.signal(signal.SIGINT, term_func)
+        if config_file is not None:
+            signal.signal(signal.SIGHUP, hup_func)
 
-    # Group devices by class.
-    by_class = {}
-    for dev in devices:
-        by_class[dev['cls']] = by_class.get(dev['cls'], []) + [dev]
+    if node is not None:
+        agent = NodeAgent(devices, node, agent_port)
+        devices = [d for d in devices if d['host'] == node]
 
-    # Group devices by class.
-    if not by_class:
+    if not devices:
         _logger.critical("No valid devices specified. Exiting")
         sys.exit()
 
-    for cls, devs in by_class.items():
-        # Keep track of how many of these classes we have set up.
-        # Some SDKs need this information to index devices.
-        count = 0
-        if issubclass(cls, microscope.devices.FloatingDeviceMixin):
-            # Need to provide maps of uid to host and port.
-            uid_to_host = {}
-            uid_to_port = {}
-            for dev in devs:
-                uid = dev['uid']
-                uid_to_host[uid] = dev['host']
-                uid_to_port[uid] = dev['port']
-        else:
-            uid_to_host = None
-            uid_to_port = None
+    if index_cache_file is None:
+        index_cache = None
+    else:
+        index_cache = _IndexCache(index_cache_file)
 
-        for dev in devs:
-            dev['conf']['index'] = count
-            servers.append(DeviceServer(dev, uid_to_host, uid_to_port,
-                                        exit_event=exit_event))
-            servers[-1].start()
-            count += 1
+    servers.update(_create_servers(devices, exit_event, index_cache))
+    for this_server, depends in servers.values():
+        this_server.start()
+
+    def config_mtime():
+        try:
+            return os.stat(config_file).st_mtime
+        except OSError:
+            return None
 
     # Main thread must be idle to process signals correctly, so use another
     # thread to check DeviceServers, restarting them where necessary. Define
     # the thread target here so that it can access variables in __main__ scope.
-    def keep_alive():
-        """Keep DeviceServers alive."""
+    def supervise():
+        """Restart DeviceServers as soon as they die.
+
+        Instead of polling, wait on the process sentinels which are
+        ready as soon as the process exits.  Servers that keep dying
+        are restarted with increasing delays, according to
+        `restart_policy`, and are given up after `max_restarts`
+        consecutive failures.  A server that ran for longer than
+        `_STABLE_RUN_TIME` seconds before dying is restarted as if it
+        had not failed before.
+
+        This is also where the device definitions are reloaded.  New
+        and changed servers are only started after the servers they
+        replace have stopped, so that their ports are free.
+        """
+        failures = {key: 0 for key in servers}
+        started = {key: time.monotonic() for key in servers}
+        # Map of server keys to time of their scheduled restart.
+        restart_at = {}
+        given_up = set()
+        # Servers to start once all stopping servers have stopped.
+        to_start = {}
+        last_mtime = config_mtime() if config_file is not None else None
+
+        def reload_devices():
+            try:
+                new_devices = validate_devices(config_file)
+            except Exception as e:
+                _logger.error("Failed to reload devices from '%s'.  Keeping"
+                              " the current device servers.", config_file,
+                              exc_info=e)
+                return
+            if node is not None:
+                agent._set_devices(new_devices)
+                new_devices = [d for d in new_devices if d['host'] == node]
+            new_servers = _create_servers(new_devices, exit_event,
+                                          index_cache)
+            for key in list(servers.keys()):
+                # Servers that were given up are restarted even if
+                # unchanged, since the reload may be to fix them.
+                if (key in new_servers and key not in given_up
+                    and _same_definitions(new_servers[key][1],
+                                          servers[key][1])):
+                    continue
+                old_server = servers.pop(key)[0]
+                _logger.info("Stopping DeviceServer with PID %s for %s.",
+                             old_server.pid, key)
+                if key not in restart_at and key not in given_up:
+                    old_server.stop()
+                    stopping.append(old_server)
+                for state in (failures, started, restart_at):
+                    state.pop(key, None)
+                given_up.discard(key)
+            for key, (new_server, depends) in new_servers.items():
+                if key not in servers:
+                    to_start[key] = (new_server, depends)
+
         while not exit_event.is_set():
-            for s in servers:
-                if s.is_alive():
+            if config_file is not None:
+                mtime = config_mtime()
+                if mtime != last_mtime:
+                    last_mtime = mtime
+                    reload_event.set()
+            if reload_event.is_set():
+                reload_event.clear()
+                _logger.info("Reloading devices from '%s'.", config_file)
+                reload_devices()
+
+            now = time.monotonic()
+            if not stopping:
+                for key, (new_server, depends) in to_start.items():
+                    servers[key] = (new_server, depends)
+                    new_server.start()
+                    failures[key] = 0
+                    started[key] = now
+                    _logger.info("Started DeviceServer with PID %s for %s.",
+                                 new_server.pid, key)
+                to_start.clear()
+
+            for key, due in list(restart_at.items()):
+                if due > now:
                     continue
-                else:
-                    _logger.info("DeviceServer Failure. Process %s is dead with"
-                                 " exitcode %s. Restarting...",
-                                 s.pid, s.exitcode)
-                    servers.remove(s)
-                    servers.append(s.clone())
-
-                    try:
-                        s.join(30)
-                    except:
-                        _logger.error("... could not join PID %s.", s.pid)
-                    else:
-                        old_pid = s.pid
-                        del (s)
-                        servers[-1].start()
-                        _logger.info("... DeviceServer with PID %s restarted"
-                                     " as PID %s.", old_pid, servers[-1].pid)
-            if len(servers) == 0:
+                del restart_at[key]
+                old_server, depends = servers[key]
+                servers[key] = (old_server.clone(), depends)
+                servers[key][0].start()
+                started[key] = now
+                _logger.info("... DeviceServer with PID %s restarted"
+                             " as PID %s.", old_server.pid,
+                             servers[key][0].pid)
+
+            running = {servers[key][0].sentinel: key for key in servers
+                       if key not in restart_at and key not in given_up}
+            if not running and not restart_at and not stopping and not to_start:
                 # Log and exit if no servers running. May want to change this
                 # if we add some interface to interactively restart servers.
                 _logger.info("No servers running. Exiting.")
                 exit_event.set()
-            try:
-                time.sleep(5)
-            except (KeyboardInterrupt, IOError):
-                pass
+                break
 
-    keep_alive_thread = Thread(target=keep_alive)
-    keep_alive_thread.start()
+            # Wake up at least every second to check the exit event,
+            # which might be set without any server dying.
+            timeout = min([1.0] + [due - now for due in restart_at.values()])
+            sentinels = (list(running.keys())
+                         + [s.sentinel for s in stopping])
+            ready = mp_connection.wait(sentinels, timeout=max(timeout, 0.0))
+            if exit_event.is_set():
+                break
+            now = time.monotonic()
+            for this_server in list(stopping):
+                if this_server.sentinel in ready:
+                    this_server.join()
+                    stopping.remove(this_server)
+                    _logger.info("DeviceServer with PID %s stopped.",
+                                 this_server.pid)
+            for sentinel in ready:
+                if sentinel not in running:
+                    continue
+                key = running[sentinel]
+                this_server = servers[key][0]
+                this_server.join()
+                _logger.info("DeviceServer Failure. Process %s is dead with"
+                             " exitcode %s.", this_server.pid,
+                             this_server.exitcode)
+                if this_server.exitcode == _IMPORT_FAILED_EXITCODE:
+                    _logger.critical("DeviceServer failed to import its"
+                                     " device.  Not restarting it.")
+                    given_up.add(key)
+                    continue
+                if now - started[key] > _STABLE_RUN_TIME:
+                    failures[key] = 0
+                failures[key] += 1
+                if failures[key] > max_restarts:
+                    _logger.critical("DeviceServer died %d consecutive times."
+                                     "  Not restarting it again.",
+                                     failures[key])
+                    given_up.add(key)
+                    continue
+                delay = restart_policy.get_delay(failures[key])
+                _logger.info("Restarting in %gs ...", delay)
+                restart_at[key] = now + delay
+
+    supervisor_thread = Thread(target=supervise)
+    supervisor_thread.start()
+
+    if node is not None:
+        # Started after the device servers so that they do not
+        # inherit its socket.
+        agent_daemon = Pyro4.Daemon(host=node, port=agent_port)
+        agent_daemon.register(agent, 'NodeAgent')
+        agent_thread = Thread(target=agent_daemon.requestLoop)
+        agent_thread.daemon = True
+        agent_thread.start()
+        _logger.info('Serving %s', agent_daemon.uriFor(agent))
 
     while not exit_event.is_set():
         try:
-            time.sleep(5)
+            # Returns early if the supervisor stops, e.g., because
+            # there are no servers running.
+            supervisor_thread.join(5)
         except (KeyboardInterrupt, IOError):
             _logger.debug("KeyboardInterrupt or IOError")
             exit_event.set()
 
     _logger.debug("Shutting down servers ...")
-    while len(servers) > 0:
-        for s in servers:
-            if not s.is_alive():
-                servers.remove(s)
-                del(s)
-        time.sleep(1)
+    # Join the supervisor first, so that it can't modify the list of
+    # servers, then wait for the servers to exit.
+    supervisor_thread.join()
+    for s, depends in servers.values():
+        s.join()
+    for s in stopping:
+        s.join()
+    if node is not None:
+        agent_daemon.shutdown()
     _logger.info(" ... No more servers running.")
-    _logger.debug("Joining threads ...")
-    keep_alive_thread.join()
-    _logger.debug("... Threads joined. Exiting.")
     return
 
 
@@ -405,6 +1179,11 @@ def __main__():
 
         deviceserver CONFIG
 
+    To serve only the devices of one computer, of a microscope with
+    devices on multiple computers, use::
+
+        deviceserver --node HOST CONFIG
+
     To configure and run as a Windows service use::
 
         deviceserver [install,remove,update,start,stop,restart,status] CONFIG
@@ -457,12 +1236,25 @@ def __console__():
 
     root_logger.addFilter(Filter())
 
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(prog='deviceserver')
+    parser.add_argument('--node',
+                        help='serve only the devices of this host, and a'
+                        ' NodeAgent to report them')
+    parser.add_argument('--agent-port', type=int, default=DEFAULT_AGENT_PORT,
+                        help='port of the NodeAgent of all nodes')
+    parser.add_argument('--index-cache', metavar='FILE',
+                        help='file to save the index of floating devices'
+                        ' so that they are opened at the same index on'
+                        ' the next start')
+    parser.add_argument('config', nargs='?')
+    args = parser.parse_args()
+
+    if args.config is None:
         _logger.critical("No config file specified. Exiting.")
         devices = []
     else:
         try:
-            devices = validate_devices(sys.argv[1])
+            devices = validate_devices(args.config)
         except Exception as e:
             _logger.critical(e)
             devices = []
@@ -470,7 +1262,9 @@ def __console__():
     if not devices:
         sys.exit(1)
 
-    serve_devices(devices)
+    serve_devices(devices, index_cache_file=args.index_cache,
+                  config_file=args.config, node=args.node,
+                  agent_port=args.agent_port)
 
 
 def __winservice__():
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the device server and clients with the test devices.
+
+Serves a :class:`TestCamera`, :class:`TestLaser`, and
+:class:`TestStage` with :func:`microscope.deviceserver.serve_devices`
+and measures:
+
+* the time for all devices to be served;
+* the round-trip latency of method calls;
+* the time to read all settings with ``get_all_settings``;
+* the frames and bytes per second received by a
+  :class:`microscope.clients.DataClient` for multiple frame sizes and
+  data types.
+
+Results are printed, or saved to a file, as JSON for comparison
+between versions.  Run it like so::
+
+    python -m microscope.testsuite.benchmark --output results.json
+
+Times are in seconds.  The test camera generates the images so its
+frame rate also includes the cost of creating them.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import Pyro4
+
+import microscope.clients
+import microscope.deviceserver
+from microscope.devices import ROI, AxisLimits, device
+from microscope.testsuite.devices import TestCamera, TestLaser, TestStage
+
+
+FRAME_SIZES = [(256, 256), (512, 512), (1024, 1024), (2048, 2048)]
+DTYPES = ['uint8', 'uint16', 'float']
+
+
+def _summarise(times):
+    """Summary statistics of a list of times."""
+    times = sorted(times)
+    summary = {'n': len(times), 'mean': sum(times) / len(times)}
+    for name, percent in [('min', 0), ('p50', 50), ('p90', 90),
+                          ('p99', 99), ('max', 100)]:
+        summary[name] = microscope.clients._percentile(times, percent)
+    return summary
+
+
+def _time_calls(func, n_calls):
+    times = []
+    for i in range(n_calls):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return _summarise(times)
+
+
+def _serve(devices, workdir):
+    # The device server writes its logs on the current directory, and
+    # also to stderr which would drown the results.
+    os.chdir(workdir)
+    sys.stderr = open(os.devnull, 'w')
+    microscope.deviceserver.serve_devices(devices)
+
+
+def _wait_for_devices(uris, timeout):
+    """Wait until all devices respond, returning the time waited."""
+    start = time.monotonic()
+    pending = list(uris)
+    while pending:
+        if time.monotonic() - start > timeout:
+            raise RuntimeError('devices not served after %gs: %s'
+                               % (timeout, ', '.join(pending)))
+        proxy = Pyro4.Proxy(pending[0])
+        try:
+            proxy.ping()
+        except Pyro4.errors.PyroError:
+            time.sleep(0.01)
+        else:
+            pending.pop(0)
+        finally:
+            proxy._pyroRelease()
+    return time.monotonic() - start
+
+
+def benchmark_latency(clients, n_calls):
+    results = {}
+    for name, client in clients.items():
+        results[name + '.ping'] = _time_calls(client.ping, n_calls)
+    laser = clients['TestLaser']
+    results['TestLaser.set_power_mw'] = _time_calls(
+        lambda: laser.set_power_mw(1.0), n_calls)
+    results['TestLaser.get_set_power_mw'] = _time_calls(
+        laser.get_set_power_mw, n_calls)
+    stage = clients['TestStage']
+    results['TestStage.move_to'] = _time_calls(
+        lambda: stage.move_to({'X': 100.0, 'Y': 100.0}), n_calls)
+    return results
+
+
+def benchmark_settings(clients, n_calls):
+    results = {}
+    for name, client in clients.items():
+        results[name] = _time_calls(client.get_all_settings, n_calls)
+    return results
+
+
+def benchmark_throughput(camera_uri, n_frames, frame_sizes, dtypes):
+    camera = microscope.clients.DataClient(camera_uri)
+    dtype_index = {name: index for index, name
+                   in camera.describe_setting('image data type')['values']}
+    pattern_index = {name: index for index, name
+                     in camera.describe_setting('image pattern')['values']}
+    # Make images as cheap as possible to generate.
+    camera.set_setting('image pattern', pattern_index['black'])
+    camera.set_setting('display image number', False)
+    camera.set_exposure_time(0.0)
+    camera.enable()
+
+    results = []
+    try:
+        for width, height in frame_sizes:
+            camera.set_roi(ROI(0, 0, width, height))
+            for dtype in dtypes:
+                camera.set_setting('image data type', dtype_index[dtype])
+                # One frame to warm up, which also gets its size.
+                camera.trigger_and_wait()
+                start = time.perf_counter()
+                camera.call_many([('soft_trigger', (), {})] * n_frames)
+                n_bytes = 0
+                for i in range(n_frames):
+                    data, timestamp = camera._buffer.get(timeout=60)
+                    n_bytes += data.nbytes
+                elapsed = time.perf_counter() - start
+                results.append({
+                    'shape': [height, width],
+                    'dtype': dtype,
+                    'frames': n_frames,
+                    'seconds': elapsed,
+                    'frames_per_second': n_frames / elapsed,
+                    'bytes_per_second': n_bytes / elapsed,
+                })
+    finally:
+        camera.disable()
+        camera.close()
+    return results
+
+
+def run(host='127.0.0.1', port=8100, n_calls=1000, n_frames=50,
+        frame_sizes=FRAME_SIZES, dtypes=DTYPES, startup_timeout=60.0):
+    """Run the benchmark and return its results.
+
+    Devices are served on `port` and the following two port numbers.
+    """
+    devices = [
+        device(TestCamera, host, port),
+        device(TestLaser, host, port +1),
+        device(TestStage, host, port +2,
+               {'limits': {'X': AxisLimits(0, 5000),
+                           'Y': AxisLimits(0, 5000)}}),
+    ]
+    uris = {d['cls'].__name__ : 'PYRO:%s@%s:%d' % (d['cls'].__name__,
+                                                   d['host'], d['port'])
+            for d in devices}
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pyro': Pyro4.__version__,
+        'serializer': Pyro4.config.SERIALIZER,
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        server = multiprocessing.Process(target=_serve,
+                                         args=(devices, workdir))
+        start = time.monotonic()
+        server.start()
+        try:
+            _wait_for_devices(list(uris.values()), startup_timeout)
+            results['startup_time'] = time.monotonic() - start
+            clients = {name: microscope.clients.Client(uri)
+                       for name, uri in uris.items()}
+            results['latency'] = benchmark_latency(clients, n_calls)
+            results['get_all_settings'] = benchmark_settings(clients,
+                                                             n_calls // 10)
+            results['throughput'] = benchmark_throughput(uris['TestCamera'],
+                                                         n_frames,
+                                                         frame_sizes, dtypes)
+        finally:
+            server.terminate()
+            server.join()
+    return results
+
+
+def __main__():
+    parser = argparse.ArgumentParser(
+        prog='python -m microscope.testsuite.benchmark',
+        description='Benchmark the device server with test devices.')
+    parser.add_argument('--output', help='file to save the results')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100,
+                        help='port of the first device, the others use'
+                        ' the next port numbers')
+    parser.add_argument('--calls', type=int, default=1000,
+                        help='number of calls to time latency')
+    parser.add_argument('--frames', type=int, default=50,
+                        help='number of frames for each size and type')
+    args = parser.parse_args()
+
+    results = run(host=args.host, port=args.port, n_calls=args.calls,
+                  n_frames=args.frames)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    __main__()
@@ -237,7 +237,7 @@ class TestCamera(devices.CameraDevice):
             if random.randint(0, 100) < self._error_percent:
                 _logger.info('Raising exception')
                 raise Exception('Exception raised in TestCamera._fetch_data')
-            _logger.info('Sending image')
+            _logger.debug('Sending image')
             time.sleep(self._exposure_time)
             self._triggered -= 1
             # Create an image
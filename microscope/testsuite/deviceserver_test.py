@@ -18,14 +18,21 @@
 ## You should have received a copy of the GNU General Public License
 ## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import logging
+import logging.handlers
 import multiprocessing
 import os.path
+import queue
+import socket
 import tempfile
+import threading
 import time
 import unittest
 import unittest.mock
 
+import Pyro4
+
 import microscope.clients
 import microscope.devices
 import microscope.deviceserver
@@ -33,6 +40,7 @@ import microscope.deviceserver
 from microscope.devices import device
 from microscope.testsuite.devices import TestCamera
 from microscope.testsuite.devices import TestFilterWheel
+from microscope.testsuite.devices import TestLaser
 
 def _serve_without_logs(*args, **kwargs):
     """Run serve_devices without noise from the logs.
@@ -132,6 +140,448 @@ class TestClashingArguments(BaseTestServeDevices):
         self.assertEqual(client.port, 7000)
 
 
+class TestGroupedDevices(BaseTestServeDevices):
+    """Devices in the same group are served from a single process"""
+    DEVICES = [
+        device(TestLaser, '127.0.0.1', 8004, group='lights'),
+        device(TestLaser, '127.0.0.1', 8005, group='lights'),
+        device(TestFilterWheel, '127.0.0.1', 8006, {'positions': 6},
+               group='lights'),
+    ]
+    def test_serving(self):
+        time.sleep(2)
+        lasers = [microscope.clients.Client('PYRO:TestLaser@127.0.0.1:%d'
+                                            % port) for port in [8004, 8005]]
+        lasers[0].set_power_mw(10.0)
+        self.assertEqual(lasers[0].get_set_power_mw(), 10.0)
+        self.assertEqual(lasers[1].get_set_power_mw(), 0.0)
+        wheel = microscope.clients.Client('PYRO:TestFilterWheel@127.0.0.1:8006')
+        self.assertEqual(wheel.get_num_positions(), 6)
+
+
+class NeverReadyDevice(microscope.devices.Device):
+    def _on_shutdown(self):
+        pass
+
+    def initialize(self):
+        raise RuntimeError("device never initialises")
+
+
+class TestGroupWithFailingDevice(BaseTestServeDevices):
+    """A device that fails to initialise does not block its group"""
+    DEVICES = [
+        device(NeverReadyDevice, '127.0.0.1', 8020, group='lights'),
+        device(TestLaser, '127.0.0.1', 8021, group='lights'),
+    ]
+    def test_others_served(self):
+        time.sleep(2)
+        laser = microscope.clients.Client('PYRO:TestLaser@127.0.0.1:8021')
+        laser.set_power_mw(10.0)
+        self.assertEqual(laser.get_set_power_mw(), 10.0)
+
+
+class CrashingDevice(microscope.devices.Device):
+    def crash(self):
+        os._exit(1)
+
+    def _on_shutdown(self):
+        pass
+
+    def initialize(self):
+        pass
+
+
+class TestRestart(BaseTestServeDevices):
+    """Device servers that die are restarted immediately"""
+    DEVICES = [
+        device(CrashingDevice, '127.0.0.1', 8007),
+    ]
+    def _wait_for_device(self, timeout):
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            try:
+                client = microscope.clients.Client(
+                    'PYRO:CrashingDevice@127.0.0.1:8007')
+                client.get_is_enabled()
+            except Exception:
+                time.sleep(0.05)
+            else:
+                return client
+        self.fail('device not being served after %s seconds' % timeout)
+
+    def test_restart(self):
+        client = self._wait_for_device(5)
+        with self.assertRaises(Exception):
+            client.crash()
+        start = time.monotonic()
+        self._wait_for_device(2)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class TestDeviceClassByPath(BaseTestServeDevices):
+    """Device classes can be given by their import path"""
+    DEVICES = [
+        device('microscope.testsuite.devices.TestLaser', '127.0.0.1', 8008),
+        device('microscope.testsuite.no_such_module.Laser', '127.0.0.1', 8009),
+    ]
+    def test_serving(self):
+        time.sleep(2)
+        self.assertTrue(self.p.is_alive(),
+                        "failure to import one device stopped the others")
+        laser = microscope.clients.Client('PYRO:TestLaser@127.0.0.1:8008')
+        laser.set_power_mw(5.0)
+        self.assertEqual(laser.get_set_power_mw(), 5.0)
+
+
+class PyroConfigDevice(microscope.devices.Device):
+    def get_pyro_config(self, name):
+        return getattr(Pyro4.config, name)
+
+    def _on_shutdown(self):
+        pass
+
+    def initialize(self):
+        pass
+
+
+class TestPyroConfig(BaseTestServeDevices):
+    """Pyro configuration is set per device server"""
+    DEVICES = [
+        device(PyroConfigDevice, '127.0.0.1', 8010,
+               pyro_config={'SERVERTYPE': 'multiplex', 'COMMTIMEOUT': 3.0}),
+    ]
+    def test_config(self):
+        time.sleep(2)
+        client = microscope.clients.Client(
+            'PYRO:PyroConfigDevice@127.0.0.1:8010')
+        self.assertEqual(client.get_pyro_config('SERVERTYPE'), 'multiplex')
+        self.assertEqual(client.get_pyro_config('COMMTIMEOUT'), 3.0)
+        self.assertEqual(Pyro4.config.SERVERTYPE, 'thread')
+
+    def test_unknown_config(self):
+        with self.assertRaises(ValueError):
+            device(PyroConfigDevice, '127.0.0.1', 8011,
+                   pyro_config={'NOT_A_PYRO_CONFIG': 1})
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'),
+                     'requires unix domain sockets')
+class TestUnixSocket(BaseTestServeDevices):
+    """Devices can also be served on a unix socket"""
+    DEVICES = [
+        device(TestLaser, '127.0.0.1', 8012, unix_socket=True),
+    ]
+    def test_client_prefers_unix_socket(self):
+        time.sleep(2)
+        client = microscope.clients.Client('PYRO:TestLaser@127.0.0.1:8012')
+        self.assertIn('./u:', client._url)
+        client.set_power_mw(3.0)
+        with Pyro4.Proxy('PYRO:TestLaser@127.0.0.1:8012') as proxy:
+            self.assertEqual(proxy.get_set_power_mw(), 3.0)
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'),
+                     'requires unix domain sockets')
+class TestUnixSocketPaths(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dirpath = tmpdir.name
+
+    def test_stale_socket_removed(self):
+        path = os.path.join(self.dirpath, 'stale.sock')
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(path)
+        microscope.deviceserver._remove_stale_socket(path)
+        self.assertFalse(os.path.exists(path))
+        ## Nothing to remove is fine too.
+        microscope.deviceserver._remove_stale_socket(path)
+
+    def test_other_files_not_removed(self):
+        path = os.path.join(self.dirpath, 'not-a-socket')
+        with open(path, 'w'):
+            pass
+        with self.assertRaises(RuntimeError):
+            microscope.deviceserver._remove_stale_socket(path)
+        self.assertTrue(os.path.exists(path))
+
+    def test_private_dir(self):
+        path = os.path.join(self.dirpath, 'sockets')
+        microscope.deviceserver._make_private_dir(path)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        ## An existing directory others can write to is refused.
+        os.chmod(path, 0o777)
+        with self.assertRaises(RuntimeError):
+            microscope.deviceserver._make_private_dir(path)
+
+
+class TestImportDeviceClass(unittest.TestCase):
+    def test_import_path(self):
+        cls = microscope.deviceserver._import_device_class(
+            'microscope.testsuite.devices.TestLaser')
+        self.assertIs(cls, TestLaser)
+
+    def test_class(self):
+        self.assertIs(microscope.deviceserver._import_device_class(TestLaser),
+                      TestLaser)
+
+    def test_class_name(self):
+        for cls in [TestLaser, 'microscope.testsuite.devices.TestLaser']:
+            self.assertEqual(microscope.deviceserver._device_class_name(cls),
+                             'TestLaser')
+
+
+class FloatingDevice(microscope.devices.FloatingDeviceMixin,
+                     microscope.devices.Device):
+    """Device whose uid is the one at its index on `uids`."""
+    def __init__(self, uids, **kwargs):
+        super().__init__(**kwargs)
+        self._uids = uids
+
+    def get_id(self):
+        return self._uids[self._index]
+
+    def _on_shutdown(self):
+        pass
+
+    def initialize(self):
+        pass
+
+
+class TestFloatingDevicesIndexCache(BaseTestServeDevices):
+    """Index where floating devices are found is cached"""
+    DEVICES = [
+        device(FloatingDevice, '127.0.0.1', 8013, {'uids': ['bar', 'foo']},
+               uid='foo'),
+        device(FloatingDevice, '127.0.0.1', 8014, {'uids': ['bar', 'foo']},
+               uid='bar'),
+    ]
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache_file = os.path.join(tmpdir.name, 'index.json')
+        self.p = multiprocessing.Process(
+            target=_serve_without_logs, args=(self.DEVICES,),
+            kwargs={'index_cache_file': self.cache_file})
+        self.p.start()
+
+    def test_cache(self):
+        time.sleep(2)
+        for port, uid in [(8013, 'foo'), (8014, 'bar')]:
+            client = microscope.clients.Client('PYRO:FloatingDevice@127.0.0.1:%d'
+                                               % port)
+            self.assertEqual(client.get_id(), uid)
+        with open(self.cache_file, 'r') as fh:
+            self.assertEqual(json.load(fh),
+                             {'FloatingDevice': {'bar': 0, 'foo': 1}})
+
+
+_RELOAD_CONFIG = """
+from microscope.devices import device
+DEVICES = [
+    device('microscope.testsuite.devices.TestLaser', '127.0.0.1', 8015),
+    device('microscope.testsuite.devices.TestFilterWheel', '127.0.0.1', 8016,
+           {'positions': %d}),
+%s]
+"""
+
+class TestReloadConfig(unittest.TestCase):
+    """Only devices whose definitions changed are restarted on reload"""
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.config_file = os.path.join(tmpdir.name, 'config.py')
+        self.write_config(6, '')
+        devices = microscope.deviceserver.validate_devices(self.config_file)
+        self.p = multiprocessing.Process(
+            target=_serve_without_logs, args=(devices,),
+            kwargs={'config_file': self.config_file})
+        self.p.start()
+
+    def tearDown(self):
+        self.p.terminate()
+        self.p.join(10)
+        self.assertFalse(self.p.is_alive(),
+                         "deviceserver not dead after SIGTERM")
+
+    def write_config(self, positions, extra):
+        with open(self.config_file, 'w') as fh:
+            fh.write(_RELOAD_CONFIG % (positions, extra))
+        # Make sure the modification time changes, whatever the
+        # resolution of the file system.
+        mtime = time.time() + getattr(self, 'n_writes', 0)
+        self.n_writes = getattr(self, 'n_writes', 0) + 1
+        os.utime(self.config_file, (mtime, mtime))
+
+    def wait_for_pid(self, uri, timeout=10, not_pid=None):
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            try:
+                pid = Pyro4.Proxy(uri).get_server_stats()['pid']
+            except Pyro4.errors.PyroError:
+                pid = None
+            if pid is not None and pid != not_pid:
+                return pid
+            time.sleep(0.1)
+        self.fail('%s not served after %s seconds' % (uri, timeout))
+
+    def test_reload(self):
+        laser_uri = 'PYRO:TestLaser@127.0.0.1:8015'
+        wheel_uri = 'PYRO:TestFilterWheel@127.0.0.1:8016'
+        laser_pid = self.wait_for_pid(laser_uri)
+        wheel_pid = self.wait_for_pid(wheel_uri)
+
+        self.write_config(8, "    device('microscope.testsuite.devices"
+                          ".TestLaser', '127.0.0.1', 8017),\n")
+        new_wheel_pid = self.wait_for_pid(wheel_uri, not_pid=wheel_pid)
+        self.wait_for_pid('PYRO:TestLaser@127.0.0.1:8017')
+        self.assertEqual(Pyro4.Proxy(wheel_uri).get_num_positions(), 8)
+        self.assertEqual(self.wait_for_pid(laser_uri), laser_pid)
+
+        # Removed devices are stopped, the others are left alone.
+        self.write_config(8, '')
+        start = time.monotonic()
+        while time.monotonic() - start < 10:
+            try:
+                Pyro4.Proxy('PYRO:TestLaser@127.0.0.1:8017').ping()
+            except Pyro4.errors.PyroError:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail('removed device still served')
+        self.assertEqual(self.wait_for_pid(laser_uri), laser_pid)
+        self.assertEqual(self.wait_for_pid(wheel_uri), new_wheel_pid)
+
+    def test_invalid_config(self):
+        laser_pid = self.wait_for_pid('PYRO:TestLaser@127.0.0.1:8015')
+        with open(self.config_file, 'a') as fh:
+            fh.write('this is not python\n')
+        time.sleep(2)
+        self.assertTrue(self.p.is_alive())
+        self.assertEqual(self.wait_for_pid('PYRO:TestLaser@127.0.0.1:8015'),
+                         laser_pid)
+
+
+def _can_bind(host):
+    try:
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+    except OSError:
+        return False
+    return True
+
+
+@unittest.skipUnless(_can_bind('127.0.0.2') and _can_bind('127.0.0.3'),
+                     'requires multiple loopback addresses')
+class TestMultiNode(unittest.TestCase):
+    """Each node serves its devices, and any agent reports all of them"""
+    DEVICES = [
+        device(TestLaser, '127.0.0.2', 8019),
+        device(TestFilterWheel, '127.0.0.3', 8019, {'positions': 6}),
+        device(TestLaser, '127.0.0.4', 8019),
+    ]
+    def setUp(self):
+        # The node on 127.0.0.4 is never started.
+        self.nodes = []
+        for host in ['127.0.0.2', '127.0.0.3']:
+            p = multiprocessing.Process(
+                target=_serve_without_logs, args=(self.DEVICES,),
+                kwargs={'node': host, 'agent_port': 8018})
+            p.start()
+            self.nodes.append(p)
+
+    def tearDown(self):
+        for p in self.nodes:
+            p.terminate()
+        for p in self.nodes:
+            p.join(10)
+            self.assertFalse(p.is_alive(),
+                             "deviceserver not dead after SIGTERM")
+
+    def get_registry(self, host, timeout=10):
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            agent = Pyro4.Proxy('PYRO:NodeAgent@%s:8018' % host)
+            try:
+                registry = agent.get_registry(0.5)
+            except Pyro4.errors.PyroError:
+                registry = {}
+            if sum(registry.values()) == 2:
+                return registry
+            time.sleep(0.1)
+        self.fail('devices not ready after %s seconds' % timeout)
+
+    def test_registry(self):
+        expected = {
+            'PYRO:TestLaser@127.0.0.2:8019': True,
+            'PYRO:TestFilterWheel@127.0.0.3:8019': True,
+            'PYRO:TestLaser@127.0.0.4:8019': False,
+        }
+        for host in ['127.0.0.2', '127.0.0.3']:
+            self.assertEqual(self.get_registry(host), expected)
+
+    def test_node_status(self):
+        self.get_registry('127.0.0.3')
+        agent = Pyro4.Proxy('PYRO:NodeAgent@127.0.0.3:8018')
+        self.assertEqual(agent.get_status(),
+                         {'PYRO:TestFilterWheel@127.0.0.3:8019': True})
+        self.assertEqual(agent.get_host(), '127.0.0.3')
+
+
+class TestAssignFloatingIndices(unittest.TestCase):
+    def test_assign(self):
+        devs = [{'uid': 'a'}, {'uid': 'b'}, {'uid': 'c'}, {'uid': 'd'}]
+        assign = microscope.deviceserver._assign_floating_indices
+        self.assertEqual(assign(devs, {}), [0, 1, 2, 3])
+        self.assertEqual(assign(devs, {'c': 0, 'a': 2}), [2, 1, 0, 3])
+        # Two devices cached on the same index.
+        self.assertEqual(assign(devs, {'a': 1, 'b': 1}), [1, 0, 2, 3])
+        # Indices out of range, or not indices at all.
+        self.assertEqual(assign(devs, {'a': 4, 'b': -1, 'c': 'x', 'd': 0}),
+                         [1, 2, 3, 0])
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_exponential_backoff(self):
+        policy = microscope.deviceserver.RetryPolicy(delay=1, factor=2,
+                                                     max_delay=10,
+                                                     first_delay=None)
+        self.assertEqual([policy.get_delay(i) for i in range(1, 7)],
+                         [1, 2, 4, 8, 10, 10])
+
+    def test_quick_first_retry(self):
+        policy = microscope.deviceserver.RetryPolicy(delay=1, factor=2,
+                                                     max_delay=10,
+                                                     first_delay=0.1)
+        self.assertEqual([policy.get_delay(i) for i in range(1, 5)],
+                         [0.1, 1, 2, 4])
+
+
+class TestFilteredQueueListener(unittest.TestCase):
+    def test_repetitions_filtered_on_listener_thread(self):
+        log_queue = queue.Queue()
+        handler = logging.handlers.BufferingHandler(capacity=100)
+        listener = microscope.deviceserver._FilteredQueueListener(log_queue,
+                                                                  handler)
+        producer = logging.handlers.QueueHandler(log_queue)
+        threads = []
+        filter_record = listener._filter.filter
+        def record_thread(record):
+            threads.append(threading.current_thread())
+            return filter_record(record)
+        with unittest.mock.patch.object(listener._filter, 'filter',
+                                        side_effect=record_thread):
+            listener.start()
+            for i in range(10):
+                producer.handle(logging.makeLogRecord({'msg': 'same'}))
+            listener.stop()
+        self.assertEqual(len(threads), 10)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual([r.msg for r in handler.buffer],
+                         ['same', 'same', 'Aggregating reps. of: same',
+                          '5 times: same'])
+
+
 class TestConfigLoader(unittest.TestCase):
     def _test_load_source(self, filename):
         file_contents = 'DEVICES = [1,2,3]'
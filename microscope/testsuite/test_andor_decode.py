@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the numpy decoder of AndorSDK3 image buffers.
+"""
+
+import unittest
+
+import numpy
+
+from microscope.cameras._andor_decode import decode_buffer
+from microscope.cameras._andor_decode import decode_mono12packed
+
+
+def _pack_mono12(image, stride):
+    """Pack rows of 12 bit pixels in 3 bytes per pair, padded to stride."""
+    height, width = image.shape
+    if width % 2:
+        image = numpy.hstack([image, numpy.zeros((height, 1), image.dtype)])
+    first = image[:, 0::2].astype(numpy.uint16)
+    second = image[:, 1::2].astype(numpy.uint16)
+    packed = numpy.empty((height, 3 * first.shape[1]), dtype=numpy.uint8)
+    packed[:, 0::3] = first >> 4
+    packed[:, 1::3] = (first & 0xF) | ((second & 0xF) << 4)
+    packed[:, 2::3] = second >> 4
+    rows = numpy.zeros((height, stride), dtype=numpy.uint8)
+    n_bytes = min(stride, packed.shape[1])
+    rows[:, :n_bytes] = packed[:, :n_bytes]
+    return rows
+
+
+def _pad(image, stride):
+    """Raw bytes of image, with each row padded to stride bytes."""
+    height = image.shape[0]
+    rows = numpy.zeros((height, stride), dtype=numpy.uint8)
+    as_bytes = image.view(numpy.uint8).reshape(height, -1)
+    rows[:, :as_bytes.shape[1]] = as_bytes
+    return rows.ravel()
+
+
+class TestDecodeMono12Packed(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.RandomState(0)
+
+    def assertDecodes(self, width, stride):
+        image = self.rng.randint(0, 2**12, size=(5, width)).astype('<u2')
+        rows = _pack_mono12(image, stride)
+        numpy.testing.assert_array_equal(decode_mono12packed(rows, width),
+                                         image)
+
+    def test_even_width(self):
+        self.assertDecodes(8, 12)
+
+    def test_odd_width(self):
+        self.assertDecodes(7, 12)
+
+    def test_padded_stride(self):
+        self.assertDecodes(8, 16)
+        self.assertDecodes(7, 16)
+
+    def test_odd_width_last_pair_cut(self):
+        # The stride only fits the first byte of the last pair.
+        image = self.rng.randint(0, 2**12, size=(5, 7)).astype('<u2')
+        image[:, -1] &= 0xFF0 # lower bits are not on the stride
+        rows = _pack_mono12(image, 10)
+        numpy.testing.assert_array_equal(decode_mono12packed(rows, 7),
+                                         image)
+
+
+class TestDecodeBuffer(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.RandomState(0)
+
+    def assertDecodes(self, encoding, dtype, max_value, width, stride):
+        image = self.rng.randint(0, max_value, size=(5, width)).astype(dtype)
+        raw = _pad(image, stride)
+        data = decode_buffer(raw, width, 5, stride, encoding)
+        self.assertEqual(data.dtype, numpy.dtype(dtype))
+        numpy.testing.assert_array_equal(data, image)
+        # The image does not share memory with the reusable buffer.
+        self.assertFalse(numpy.shares_memory(data, raw))
+
+    def test_mono12(self):
+        self.assertDecodes('Mono12', '<u2', 2**12, 7, 14)
+        self.assertDecodes('Mono12', '<u2', 2**12, 7, 16)
+
+    def test_mono16(self):
+        self.assertDecodes('Mono16', '<u2', 2**16, 8, 16)
+        self.assertDecodes('Mono16', '<u2', 2**16, 7, 20)
+
+    def test_mono32_left_to_sdk(self):
+        ## The SDK converts all images to uint16, so Mono32 images
+        ## would have another dtype if decoded here.
+        raw = numpy.zeros(5 * 32, dtype=numpy.uint8)
+        self.assertIsNone(decode_buffer(raw, 8, 5, 32, 'Mono32'))
+
+    def test_mono12packed(self):
+        image = self.rng.randint(0, 2**12, size=(5, 7)).astype('<u2')
+        raw = _pack_mono12(image, 12).ravel()
+        numpy.testing.assert_array_equal(
+            decode_buffer(raw, 7, 5, 12, 'Mono12Packed'), image)
+
+    def test_raw_longer_than_image(self):
+        image = self.rng.randint(0, 2**16, size=(5, 8)).astype('<u2')
+        raw = numpy.concatenate([_pad(image, 16),
+                                 numpy.ones(32, dtype=numpy.uint8)])
+        numpy.testing.assert_array_equal(
+            decode_buffer(raw, 8, 5, 16, 'Mono16'), image)
+
+    def test_unsupported_encoding(self):
+        raw = numpy.zeros(5 * 16, dtype=numpy.uint8)
+        self.assertIsNone(decode_buffer(raw, 8, 5, 16, 'RGB8Packed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+
+import microscope.testsuite.benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_short_run(self):
+        """Benchmark runs and its results can be saved as JSON"""
+        results = microscope.testsuite.benchmark.run(
+            port=8030, n_calls=10, n_frames=3, frame_sizes=[(64, 32)],
+            dtypes=['uint8', 'uint16'])
+        json.dumps(results)
+        self.assertGreater(results['startup_time'], 0.0)
+        self.assertIn('TestLaser.ping', results['latency'])
+        self.assertIn('TestCamera', results['get_all_settings'])
+        self.assertEqual(len(results['throughput']), 2)
+        for result, dtype_size in zip(results['throughput'], [1, 2]):
+            self.assertEqual(result['shape'], [32, 64])
+            self.assertAlmostEqual(result['bytes_per_second'],
+                                   result['frames_per_second']
+                                   * 64 * 32 * dtype_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
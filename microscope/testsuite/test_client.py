@@ -18,12 +18,19 @@
 ## You should have received a copy of the GNU General Public License
 ## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import os.path
+import socket
+import tempfile
+import time
 import unittest
+import unittest.mock
 import threading
 
 import Pyro4
 
 import microscope.clients
+import microscope.devices
 import microscope.testsuite.devices as dummies
 
 
@@ -44,6 +51,20 @@ class PyroService:
     @attr.setter
     def attr(self, value):  # exposed as 'proxy.attr' writable
         self._value = value
+    def get_value(self):
+        return self._value
+    def sleep(self, seconds):
+        time.sleep(seconds)
+    def ping(self):
+        return True
+
+
+@Pyro4.expose
+class UpdatedPyroService(PyroService):
+    """A PyroService after an update, to test stale metadata."""
+    def nap(self, seconds):
+        time.sleep(seconds)
+        return True
 
 
 @Pyro4.expose
@@ -59,10 +80,70 @@ class ExposedDeformableMirror(dummies.TestDeformableMirror):
         return super().n_actuators
 
 
+@Pyro4.expose
+class ExposedTestLaser(dummies.TestLaser):
+    def call_many(self, calls):
+        return super().call_many(calls)
+    def get_session_id(self):
+        return super().get_session_id()
+    @Pyro4.oneway
+    def call_oneway(self, client_id, seq, name, args, kwargs,
+                    session_id=None):
+        return super().call_oneway(client_id, seq, name, args, kwargs,
+                                   session_id)
+    def drain_oneway_errors(self, client_id, seq, session_id=None):
+        return super().drain_oneway_errors(client_id, seq, session_id)
+    def get_set_power_mw(self):
+        return super().get_set_power_mw()
+
+
+class TestDataClientListeners(unittest.TestCase):
+    def setUp(self):
+        self.daemon = Pyro4.Daemon()
+        self.uri = self.daemon.register(PyroService())
+        self.thread = threading.Thread(target=self.daemon.requestLoop)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+
+    def test_local_address(self):
+        for host in ['127.0.0.1', 'localhost']:
+            self.assertEqual(microscope.clients._local_address_to(host),
+                             '127.0.0.1')
+
+    def test_shared_listener(self):
+        clients = [microscope.clients.DataClient(self.uri) for i in range(2)]
+        self.assertIs(clients[0]._listener, clients[1]._listener)
+        self.assertIs(clients[0]._listener,
+                      microscope.clients.LISTENERS['127.0.0.1'])
+        for client in clients:
+            client.close()
+
+    def test_dedicated_listener(self):
+        client = microscope.clients.DataClient(self.uri,
+                                               dedicated_listener=True,
+                                               servertype='multiplex')
+        self.assertNotIn(client._listener,
+                         microscope.clients.LISTENERS.values())
+        self.assertEqual(client._listener.transportServer.__class__.__name__,
+                         'SocketServer_Multiplex')
+        receiver = Pyro4.Proxy(client._client_uri)
+        receiver.receiveData('data', 1.0)
+        self.assertEqual(client._buffer.get(timeout=1), ('data', 1.0))
+        receiver._pyroRelease()
+        client.close()
+
+
 class TestClient(unittest.TestCase):
     def setUp(self):
         self.daemon = Pyro4.Daemon()
         self.thread = threading.Thread(target=self.daemon.requestLoop)
+        cache_patcher = unittest.mock.patch.dict(
+            microscope.clients._METADATA_CACHE, clear=True)
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
 
     def tearDown(self):
         self.daemon.shutdown()
@@ -97,6 +178,348 @@ class TestClient(unittest.TestCase):
         self.assertTrue(client.attr, 10)
         self.assertTrue(obj.attr, 10)
 
+    def test_property_is_remote(self):
+        """Properties are read from and written to the remote object"""
+        obj = PyroService()
+        client = (self._serve_objs([obj]))[0]
+        obj.attr = 5
+        self.assertEqual(client.attr, 5)
+        client.attr = 10
+        self.assertEqual(obj.attr, 10)
+
+    def test_methods_bound_on_first_use(self):
+        client = (self._serve_objs([PyroService()]))[0]
+        self.assertNotIn('get_value', vars(client))
+        self.assertEqual(client.get_value(), 42)
+        self.assertIn('get_value', vars(client))
+
+    def _time_concurrent_sleeps(self, client, n_threads, seconds):
+        threads = [threading.Thread(target=client.sleep, args=(seconds,))
+                   for i in range(n_threads)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start
+
+    def test_concurrent_calls(self):
+        """Calls from multiple threads run concurrently"""
+        client = (self._serve_objs([PyroService()]))[0]
+        elapsed = self._time_concurrent_sleeps(client, 4, 0.2)
+        self.assertLess(elapsed, 0.6)
+
+    def test_max_proxies(self):
+        """Calls beyond max_proxies wait for a free proxy"""
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        client = microscope.clients.Client(uri, max_proxies=1)
+        elapsed = self._time_concurrent_sleeps(client, 3, 0.1)
+        self.assertGreaterEqual(elapsed, 0.3)
+
+    def test_missing_member(self):
+        client = (self._serve_objs([PyroService()]))[0]
+        with self.assertRaises(AttributeError):
+            client.not_a_remote_member
+
+    def _count_get_metadata(self):
+        """Mock that counts requests for metadata on the server."""
+        patcher = unittest.mock.patch.object(
+            Pyro4.core.DaemonObject, 'get_metadata', autospec=True,
+            side_effect=Pyro4.core.DaemonObject.get_metadata)
+        get_metadata = patcher.start()
+        self.addCleanup(patcher.stop)
+        return get_metadata
+
+    def test_cached_metadata_defers_connection(self):
+        uri = self.daemon.register(ExposedDeformableMirror(10))
+        self.thread.start()
+        microscope.clients.Client(uri)
+        get_metadata = self._count_get_metadata()
+        client = microscope.clients.Client(uri)
+        self.assertEqual(get_metadata.call_count, 0)
+        self.assertEqual(client.n_actuators, 10)
+        ## Sent with the connection handshake.
+        self.assertEqual(get_metadata.call_count, 1)
+
+    def test_metadata_without_cache(self):
+        uri = self.daemon.register(ExposedDeformableMirror(10))
+        self.thread.start()
+        get_metadata = self._count_get_metadata()
+        client = microscope.clients.Client(uri)
+        self.assertEqual(get_metadata.call_count, 1)
+        self.assertEqual(client.n_actuators, 10)
+        self.assertEqual(get_metadata.call_count, 1)
+
+    def test_metadata_cached_per_object_id(self):
+        uris = [self.daemon.register(ExposedDeformableMirror(10), 'mirror'),
+                self.daemon.register(PyroService())]
+        self.thread.start()
+        for uri in uris:
+            microscope.clients.Client(uri)
+        self.assertEqual(set(microscope.clients._METADATA_CACHE.keys()),
+                         set([uri.object for uri in uris]))
+
+    def test_refreshed_metadata_reaches_all_proxies(self):
+        uri = self.daemon.register(PyroService(), 'service')
+        self.thread.start()
+        microscope.clients.Client(uri)
+        ## From cached metadata, and with two proxies in the pool.
+        client = microscope.clients.Client(uri)
+        self._time_concurrent_sleeps(client, 2, 0.1)
+        self.daemon.unregister('service')
+        self.daemon.register(UpdatedPyroService(), 'service')
+        nap = client.nap
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(nap, 0.1) for i in range(2)]
+            for future in futures:
+                self.assertTrue(future.result())
+
+    def test_stale_cache_is_refreshed(self):
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        microscope.clients._METADATA_CACHE[uri.object] = {
+            'methods': set(), 'oneway': set(), 'attrs': {'old_attr'},
+        }
+        client = microscope.clients.Client(uri)
+        self.assertEqual(client.attr, 42)
+
+    def test_ping_devices(self):
+        uris = [self.daemon.register(PyroService()) for i in range(2)]
+        self.thread.start()
+        report = microscope.clients.ping_devices(uris, count=5)
+        self.assertEqual(set(report.keys()), set([str(u) for u in uris]))
+        for stats in report.values():
+            self.assertEqual(stats['lost'], 0)
+            self.assertLessEqual(stats['min'], stats['p50'])
+            self.assertLessEqual(stats['p50'], stats['p99'])
+            self.assertLessEqual(stats['p99'], stats['max'])
+
+    def test_ping_no_devices(self):
+        self.thread.start()
+        self.assertEqual(microscope.clients.ping_devices([]), {})
+
+    def test_ping_more_devices_than_threads(self):
+        uris = [self.daemon.register(PyroService()) for i in range(3)]
+        self.thread.start()
+        with unittest.mock.patch('microscope.clients._MAX_PING_THREADS', 2):
+            report = microscope.clients.ping_devices(uris, count=2)
+        self.assertEqual([stats['lost'] for stats in report.values()],
+                         [0, 0, 0])
+
+    def test_ping_unreachable_device(self):
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        bad_uri = 'PYRO:nothing@127.0.0.1:1'
+        report = microscope.clients.ping_devices([uri, bad_uri], count=3,
+                                                 timeout=0.5)
+        self.assertEqual(report[str(uri)]['lost'], 0)
+        self.assertEqual(report[bad_uri]['lost'], 3)
+        self.assertIsNone(report[bad_uri]['p50'])
+
+    def test_batch(self):
+        laser = ExposedTestLaser()
+        client = (self._serve_objs([laser]))[0]
+        with client.batch() as batch:
+            batch.set_power_mw(10.0)
+            power = batch.get_set_power_mw()
+            status = batch.get_status()
+        self.assertEqual(power.result(), 10.0)
+        self.assertEqual(status.result(), laser.get_status())
+
+    def test_batch_error(self):
+        """First error is raised after all calls are made"""
+        laser = ExposedTestLaser()
+        client = (self._serve_objs([laser]))[0]
+        with self.assertRaises(AttributeError):
+            with client.batch() as batch:
+                missing = batch.not_a_method()
+                batch.set_power_mw(5.0)
+        self.assertIsInstance(missing.exception(), AttributeError)
+        self.assertEqual(laser.get_set_power_mw(), 5.0)
+
+    def test_batch_not_made_on_error(self):
+        laser = ExposedTestLaser()
+        client = (self._serve_objs([laser]))[0]
+        with self.assertRaises(RuntimeError):
+            with client.batch() as batch:
+                future = batch.set_power_mw(5.0)
+                raise RuntimeError()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(laser.get_set_power_mw(), 0.0)
+
+    def test_oneway_calls_in_order(self):
+        client = (self._serve_objs([ExposedTestLaser()]))[0]
+        for power in range(1, 51):
+            self.assertIsNone(client.oneway.set_power_mw(float(power)))
+        self.assertEqual(client.get_set_power_mw(), 50.0)
+
+    def test_oneway_error_raised_on_next_call(self):
+        client = (self._serve_objs([ExposedTestLaser()]))[0]
+        client.oneway.not_a_method()
+        client.oneway.set_power_mw(2.0)
+        with self.assertRaises(AttributeError):
+            client.get_set_power_mw()
+        self.assertEqual(client.get_set_power_mw(), 2.0)
+
+    def test_get_oneway_errors(self):
+        client = (self._serve_objs([ExposedTestLaser()]))[0]
+        client.oneway.not_a_method()
+        client.oneway.set_power_mw()  # missing argument
+        errors = client.get_oneway_errors()
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(client.get_oneway_errors(), [])
+        self.assertEqual(client.get_set_power_mw(), 0.0)
+
+    def test_oneway_after_server_restart(self):
+        """Oneway calls start a new sequence when the server restarts"""
+        laser = ExposedTestLaser()
+        client = (self._serve_objs([laser]))[0]
+        client.oneway.set_power_mw(1.0)
+        self.assertEqual(client.get_set_power_mw(), 1.0)
+        # A restarted server has a new session and no sequence state.
+        laser._session_id = 'restarted'
+        laser._oneway_last_seq.clear()
+        client.oneway.set_power_mw(2.0)
+        with self.assertRaises(microscope.devices.OnewaySessionError):
+            client.get_oneway_errors()
+        client.oneway.set_power_mw(3.0)
+        self.assertEqual(client.get_oneway_errors(), [])
+        self.assertEqual(client.get_set_power_mw(), 3.0)
+
+    def _make_unix_socket_path(self, uri):
+        os.makedirs(microscope.clients._unix_socket_dir(), mode=0o700,
+                    exist_ok=True)
+        path = microscope.clients._unix_socket_path(uri.host, uri.port)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_not_socket_ignored(self):
+        """A file on the path of the unix socket is ignored"""
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        with open(self._make_unix_socket_path(uri), 'w'):
+            pass
+        client = microscope.clients.Client(uri)
+        self.assertEqual(str(client._url), str(uri))
+        self.assertEqual(client.get_value(), 42)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'),
+                         'requires unix domain sockets')
+    def test_stale_unix_socket(self):
+        """Unreachable unix socket is ignored"""
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(self._make_unix_socket_path(uri))
+        client = microscope.clients.Client(uri)
+        self.assertEqual(str(client._url), str(uri))
+        self.assertEqual(client.get_value(), 42)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'),
+                         'requires unix domain sockets')
+    def test_hung_unix_socket(self):
+        """Unix socket that never completes the handshake is ignored"""
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(self._make_unix_socket_path(uri))
+            sock.listen(1) # but never accept
+            start = time.monotonic()
+            client = microscope.clients.Client(uri, timeout=0.5)
+            self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(str(client._url), str(uri))
+        self.assertEqual(client.get_value(), 42)
+
+    def test_unix_socket_not_for_pyroname(self):
+        """URIs without a port, such as PYRONAME, are left alone"""
+        self.thread.start()
+        for url in ['PYRONAME:microscope.laser',
+                    'PYRONAME:microscope.laser@localhost:9090']:
+            self.assertEqual(microscope.clients._prefer_unix_socket(url),
+                             url)
+
+    def test_metadata_cache_file(self):
+        uri = self.daemon.register(PyroService())
+        self.thread.start()
+        microscope.clients.Client(uri)
+        with tempfile.TemporaryDirectory() as dirpath:
+            filepath = os.path.join(dirpath, 'metadata.json')
+            microscope.clients.save_metadata_cache(filepath)
+            microscope.clients._METADATA_CACHE.clear()
+            microscope.clients.load_metadata_cache(filepath)
+        self.assertEqual(microscope.clients._METADATA_CACHE[uri.object]['attrs'],
+                         {'attr'})
+
+
+class TestClientGroup(unittest.TestCase):
+    def setUp(self):
+        self.daemon = Pyro4.Daemon()
+        self.uris = [str(self.daemon.register(PyroService()))
+                     for i in range(3)]
+        self.thread = threading.Thread(target=self.daemon.requestLoop)
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+
+    def test_call(self):
+        group = microscope.clients.ClientGroup(self.uris)
+        self.assertEqual(group.call('get_value'),
+                         {uri: (42, None) for uri in self.uris})
+        group.close()
+
+    def test_concurrent(self):
+        group = microscope.clients.ClientGroup(self.uris)
+        start = time.monotonic()
+        group.call('sleep', 0.3)
+        self.assertLess(time.monotonic() - start, 0.6)
+        group.close()
+
+    def test_call_each(self):
+        group = microscope.clients.ClientGroup(self.uris)
+        results = group.call_each({self.uris[0]: ('get_value', (), {}),
+                                   self.uris[1]: ('sleep', (0.0,), {})})
+        self.assertEqual(results, {self.uris[0]: (42, None),
+                                   self.uris[1]: (None, None)})
+        group.close()
+
+    def test_timeout(self):
+        group = microscope.clients.ClientGroup(self.uris, timeout=0.2)
+        start = time.monotonic()
+        results = group.call_each({self.uris[0]: ('sleep', (1.0,), {}),
+                                   self.uris[1]: ('get_value', (), {})})
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertIsInstance(results[self.uris[0]][1],
+                              Pyro4.errors.TimeoutError)
+        self.assertEqual(results[self.uris[1]], (42, None))
+        group.close()
+
+    def test_per_device_timeout(self):
+        timeouts = {self.uris[0]: 2.0, self.uris[1]: 0.2}
+        group = microscope.clients.ClientGroup(self.uris[:2], timeout=timeouts)
+        results = group.call('sleep', 0.5)
+        self.assertEqual(results[self.uris[0]], (None, None))
+        self.assertIsInstance(results[self.uris[1]][1],
+                              Pyro4.errors.TimeoutError)
+        group.close()
+
+    def test_per_device_timeout_missing(self):
+        with self.assertRaisesRegex(ValueError, self.uris[1]):
+            microscope.clients.ClientGroup(self.uris[:2],
+                                           timeout={self.uris[0]: 1.0})
+
+    def test_unreachable_device(self):
+        uris = self.uris + ['PYRO:PyroService@127.0.0.1:1']
+        group = microscope.clients.ClientGroup(uris, timeout=0.5)
+        results = group.call('get_value')
+        self.assertIsInstance(results[uris[-1]][1],
+                              Pyro4.errors.CommunicationError)
+        for uri in self.uris:
+            self.assertEqual(results[uri], (42, None))
+        group.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -36,11 +36,16 @@ the device instance required to run the tests.
 
 """
 
+import logging
+import os
+import threading
+import time
 import unittest
 import unittest.mock
 
 import numpy
 
+import microscope.devices
 import microscope.testsuite.devices as dummies
 import microscope.testsuite.mock_devices as mocks
 
@@ -91,6 +96,32 @@ class TestSerialMock(unittest.TestCase):
         self.assertEqual(self.serial.readline(), b'qux\r\n')
 
 
+class TestRateLimitedLog(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('microscope.testsuite.ratelimited')
+        self.log = microscope.devices.RateLimitedLog(self.logger,
+                                                     logging.INFO,
+                                                     interval=0.2)
+
+    def test_rate_limit(self):
+        with self.assertLogs(self.logger, logging.INFO) as logs:
+            for i in range(10):
+                self.log('frame %d', i)
+            time.sleep(0.2)
+            self.log('frame %d', 10)
+        self.assertEqual(logs.output, [
+            'INFO:microscope.testsuite.ratelimited:frame 0',
+            'INFO:microscope.testsuite.ratelimited:frame 10'
+            ' (and 9 similar messages)',
+        ])
+
+    def test_disabled_level(self):
+        with self.assertLogs(self.logger, logging.WARNING) as logs:
+            self.log('not logged')
+            self.logger.warning('logged')
+        self.assertEqual(len(logs.output), 1)
+
+
 class DeviceTests:
     """Tests cases for all devices.
 
@@ -121,6 +152,28 @@ class DeviceTests:
         self.device.disable()
         self.device.shutdown()
 
+    def test_ping(self):
+        self.assertTrue(self.device.ping())
+
+    def test_server_stats(self):
+        stats = self.device.get_server_stats()
+        self.assertEqual(stats['pid'], os.getpid())
+        self.assertGreaterEqual(stats['uptime'], 0.0)
+        self.assertGreaterEqual(stats['threads'], 1)
+
+    def test_call_many(self):
+        self.device.initialize()
+        results = self.device.call_many([
+            ('get_is_enabled', (), {}),
+            ('not_a_method', (), {}),
+            ('_on_shutdown', (), {}),
+            ('ping', (), {}),
+        ])
+        self.assertEqual(results[0], (self.device.get_is_enabled(), None))
+        self.assertIsInstance(results[1][1], AttributeError)
+        self.assertIsInstance(results[2][1], AttributeError)
+        self.assertEqual(results[3], (True, None))
+
     def test_enable_enabled(self):
         """Handles enabling of an already enabled device"""
         self.device.initialize()
@@ -361,6 +414,54 @@ class TestDummyLaser(unittest.TestCase, LaserTests):
         self.fake.min_power = 0.0
         self.fake.max_power = 100.0
 
+    def test_oneway_calls_in_order(self):
+        """Oneway calls are made in sequence, even if started out of order"""
+        later = threading.Thread(target=self.device.call_oneway,
+                                 args=('id', 2, 'set_power_mw', (20.0,), {}))
+        later.start()
+        self.device.call_oneway('id', 1, 'set_power_mw', (10.0,), {})
+        later.join()
+        self.assertEqual(self.device.get_set_power_mw(), 20.0)
+
+    def test_drain_oneway_errors(self):
+        self.device.call_oneway('id', 1, 'not_a_method', (), {})
+        self.device.call_oneway('other', 1, 'not_a_method', (), {})
+        errors = self.device.drain_oneway_errors('id', 1)
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], AttributeError)
+        self.assertEqual(self.device.drain_oneway_errors('id', 1), [])
+        self.assertEqual(len(self.device.drain_oneway_errors('other', 1)), 1)
+
+    def test_oneway_missing_call_times_out(self):
+        self.device._oneway_timeout = 0.1
+        self.device.call_oneway('id', 2, 'set_power_mw', (20.0,), {})
+        self.device.call_oneway('id', 1, 'set_power_mw', (10.0,), {})
+        errors = self.device.drain_oneway_errors('id', 2)
+        self.assertEqual(len(errors), 2)
+        self.assertIsInstance(errors[0], TimeoutError)
+        self.assertEqual(self.device.get_set_power_mw(), 0.0)
+        with self.assertRaises(TimeoutError):
+            self.device.drain_oneway_errors('id', 3)
+
+    def test_oneway_other_session(self):
+        session = self.device.get_session_id()
+        self.device.call_oneway('id', 5, 'set_power_mw', (20.0,), {},
+                                'previous')
+        self.assertEqual(self.device.get_set_power_mw(), 0.0)
+        with self.assertRaises(microscope.devices.OnewaySessionError):
+            self.device.drain_oneway_errors('id', 5, 'previous')
+        self.device.call_oneway('id', 1, 'set_power_mw', (10.0,), {},
+                                session)
+        self.assertEqual(self.device.drain_oneway_errors('id', 1, session),
+                         [])
+
+    def test_oneway_idle_clients_forgotten(self):
+        self.device.call_oneway('gone', 1, 'not_a_method', (), {})
+        self.device._oneway_client_expiry = 0.0
+        self.device.call_oneway('id', 1, 'set_power_mw', (10.0,), {})
+        self.assertNotIn('gone', self.device._oneway_last_seq)
+        self.assertNotIn('gone', self.device._oneway_errors)
+
     def test_being(self):
         ## TODO: this test uses is_alive but that's actually a method
         ## of SerialDeviceMixIn and not specific to lasers.  It is not
@@ -491,6 +592,47 @@ class TestDummyDSP(unittest.TestCase, DSPTests):
         self.device = dummies.DummyDSP()
 
 
+class SlowInitDevice(dummies.TestFilterWheel):
+    def initialize(self):
+        time.sleep(0.2)
+        self.initialized_by = threading.current_thread()
+
+
+class _ControllerWithSlowDevices(microscope.devices.ControllerDevice):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._devices = {str(i): SlowInitDevice() for i in range(3)}
+
+    @property
+    def devices(self):
+        return self._devices
+
+
+class TestControllerInitialize(unittest.TestCase):
+    def test_serial_by_default(self):
+        controller = _ControllerWithSlowDevices()
+        controller.initialize()
+        threads = [d.initialized_by for d in controller.devices.values()]
+        self.assertEqual(threads, 3 * [threading.current_thread()])
+
+    def test_concurrent(self):
+        controller = _ControllerWithSlowDevices()
+        controller._initialize_concurrently = True
+        start = time.monotonic()
+        controller.initialize()
+        self.assertLess(time.monotonic() - start, 0.5)
+        threads = {d.initialized_by for d in controller.devices.values()}
+        self.assertEqual(len(threads), 3)
+
+    def test_concurrent_failure(self):
+        controller = _ControllerWithSlowDevices()
+        controller._initialize_concurrently = True
+        with unittest.mock.patch.object(controller.devices['1'], 'initialize',
+                                        side_effect=RuntimeError('failed')):
+            with self.assertRaisesRegex(RuntimeError, 'failed'):
+                controller.initialize()
+
+
 class TestBaseDevice(unittest.TestCase):
     def test_unexpected_kwargs_raise_exception(self):
         """Unexpected kwargs on constructor raise exception.
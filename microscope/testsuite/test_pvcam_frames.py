@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the frames on the circular buffer of PVCAM cameras.
+"""
+
+import unittest
+
+import numpy
+
+from microscope.cameras._pvcam_frames import CircularBufferFrames
+
+
+class TestCircularBufferFrames(unittest.TestCase):
+    def setUp(self):
+        self.buffer = numpy.zeros((5, 4, 4), dtype=numpy.uint16)
+        self.frames = CircularBufferFrames(self.buffer)
+
+    def write(self, slot, value):
+        """Write a frame on slot, as the SDK would."""
+        self.buffer[slot] = value
+        return self.frames.take(slot)
+
+    def test_slot_of(self):
+        for slot in range(len(self.buffer)):
+            self.assertEqual(
+                self.frames.slot_of(self.buffer[slot].ctypes.data), slot)
+
+    def test_frame_is_view(self):
+        frame = self.write(1, 7)
+        data = self.frames.claim(frame)
+        self.assertTrue(numpy.shares_memory(data, self.buffer))
+        numpy.testing.assert_array_equal(data, 7)
+        self.frames.release(frame)
+        self.assertEqual(self.frames.copies, 0)
+
+    def test_pending_frames_copied_before_overwritten(self):
+        frames = [self.write(slot, slot +1) for slot in range(3)]
+        self.assertEqual(self.frames.copies, 0)
+        ## After slot 3, the SDK writes on slots 4 and 0, so the frame
+        ## waiting on slot 0 is copied.
+        self.write(3, 4)
+        self.assertEqual(self.frames.copies, 1)
+        self.assertFalse(numpy.shares_memory(frames[0].data, self.buffer))
+        for frame in frames[1:]:
+            self.assertTrue(numpy.shares_memory(frame.data, self.buffer))
+        self.buffer[0] = 10
+        for i, frame in enumerate(frames):
+            numpy.testing.assert_array_equal(self.frames.claim(frame), i +1)
+
+    def test_released_frames_not_copied(self):
+        for slot in range(8):
+            frame = self.write(slot % 5, slot)
+            self.frames.claim(frame)
+            self.frames.release(frame)
+        self.assertEqual(self.frames.copies, 0)
+
+    def test_dispatching_frames_are_late(self):
+        frames = [self.write(slot, slot) for slot in range(3)]
+        self.frames.claim(frames[0])
+        self.write(3, 3)
+        self.assertEqual(self.frames.late, 1)
+        self.assertEqual(self.frames.copies, 0)
+        ## Being sent, it is still a view of the buffer.
+        self.assertTrue(numpy.shares_memory(frames[0].data, self.buffer))
+
+    def test_release_of_replaced_frame(self):
+        old = self.write(1, 1)
+        new = self.write(1, 2)
+        ## Releasing the old frame does not release the new one.
+        self.frames.release(old)
+        self.write(4, 3)
+        self.assertEqual(self.frames.copies, 1)
+        numpy.testing.assert_array_equal(self.frames.claim(new), 2)
+
+    def test_short_buffer_copies_at_once(self):
+        for length in [2, 3]:
+            buffer = numpy.zeros((length, 4, 4), dtype=numpy.uint16)
+            frames = CircularBufferFrames(buffer)
+            buffer[1] = 5
+            frame = frames.take(1)
+            self.assertFalse(numpy.shares_memory(frame.data, buffer))
+            numpy.testing.assert_array_equal(frames.claim(frame), 5)
+            frames.release(frame)
+            self.assertEqual(frames.copies, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+import threading
+import unittest
+
+import numpy
+import Pyro4
+
+import microscope._serializer
+import microscope.clients
+
+
+@unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5,
+                 'requires pickle protocol 5')
+class TestOutOfBandPickleSerializer(unittest.TestCase):
+    def setUp(self):
+        self.serializer = Pyro4.util.get_serializer(
+            microscope._serializer.NAME)
+
+    def roundtrip(self, data):
+        return self.serializer.loads(self.serializer.dumps(data))
+
+    def test_arrays(self):
+        arrays = [
+            numpy.arange(12, dtype=numpy.uint16).reshape(3, 4),
+            numpy.asfortranarray(numpy.random.rand(5, 7)),
+            numpy.arange(20, dtype=numpy.int8)[::3],  # not contiguous
+            numpy.zeros((0, 4)),
+        ]
+        for array in arrays:
+            with self.subTest(array=array):
+                copy = self.roundtrip(array)
+                numpy.testing.assert_array_equal(copy, array)
+                self.assertEqual(copy.dtype, array.dtype)
+
+    def test_arrays_are_writable(self):
+        array = self.roundtrip(numpy.ones((4, 4)))
+        array[0, 0] = 2
+        self.assertEqual(array[0, 0], 2)
+
+    def test_mixed_data(self):
+        data = ([numpy.arange(3), 'foo', {'bar': b'qux'}], 12.5)
+        copy = self.roundtrip(data)
+        numpy.testing.assert_array_equal(copy[0][0], numpy.arange(3))
+        self.assertEqual(copy[0][1:], data[0][1:])
+        self.assertEqual(copy[1], data[1])
+
+    def test_call(self):
+        call = ('obj', 'method', (numpy.arange(4),), {'key': 1})
+        data = self.serializer.dumpsCall(*call)
+        obj, method, vargs, kwargs = self.serializer.loadsCall(data)
+        self.assertEqual((obj, method, kwargs), ('obj', 'method', {'key': 1}))
+        numpy.testing.assert_array_equal(vargs[0], numpy.arange(4))
+
+
+@Pyro4.expose
+class ArrayService:
+    def get_image(self, shape):
+        return numpy.arange(numpy.prod(shape)).reshape(shape)
+
+    def sum(self, array):
+        return array.sum()
+
+
+class TestServing(unittest.TestCase):
+    def setUp(self):
+        self.daemon = Pyro4.Daemon()
+        self.thread = threading.Thread(target=self.daemon.requestLoop)
+        self.uri = self.daemon.register(ArrayService())
+        self.thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+
+    def test_arrays_through_client(self):
+        client = microscope.clients.Client(self.uri)
+        image = client.get_image((16, 8))
+        numpy.testing.assert_array_equal(image,
+                                         numpy.arange(128).reshape(16, 8))
+        self.assertEqual(client.sum(image), image.sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
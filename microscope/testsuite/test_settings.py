@@ -22,9 +22,17 @@
 """
 
 import enum
+import json
+import os.path
+import tempfile
+import threading
 import unittest
+import unittest.mock
+
+import numpy
 
 import microscope.devices
+import microscope.testsuite.devices as dummies
 
 
 class EnumSetting(enum.Enum):
@@ -77,5 +85,194 @@ class TestEnumSetting(unittest.TestCase):
         self.assertEqual(EnumSetting(2), thing.val)
 
 
+class DeviceWithSlowSetting(microscope.devices.Device):
+    """Device with one setting whose getter blocks until released."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.n_slow_reads = 0
+        self.add_setting('fast', 'int', lambda: 1, None, (0, 10))
+        self.add_setting('slow', 'int', self._get_slow, None, (0, 10))
+        self.add_setting('broken', 'int', self._get_broken, None, (0, 10))
+
+    def _get_slow(self):
+        self.n_slow_reads += 1
+        self.release.wait()
+        return 2
+
+    def _get_broken(self):
+        raise RuntimeError('broken getter')
+
+    def initialize(self):
+        pass
+
+    def _on_shutdown(self):
+        self.release.set()
+
+
+class TestGetAllSettings(unittest.TestCase):
+    def setUp(self):
+        self.device = DeviceWithSlowSetting()
+        self.addCleanup(self.device.release.set)
+
+    def test_sequential_by_default(self):
+        self.device.release.set()
+        self.assertEqual(self.device.get_all_settings(),
+                         {'fast': 1, 'slow': 2, 'broken': None})
+
+    def test_timeout_reports_sentinel(self):
+        settings = self.device.get_all_settings(timeout=0.1)
+        self.assertEqual(settings['fast'], 1)
+        self.assertIs(settings['slow'], microscope.devices.TIMED_OUT)
+        self.assertIsNone(settings['broken'])
+        self.assertEqual(list(settings.keys()), ['fast', 'slow', 'broken'])
+
+    def test_shared_comms_lock_is_one_group(self):
+        self.device._comms_lock = threading.RLock()
+        settings = self.device.get_all_settings(timeout=0.1)
+        ## Getters run in order so the one after 'slow' is not read.
+        self.assertEqual(settings['fast'], 1)
+        self.assertIs(settings['slow'], microscope.devices.TIMED_OUT)
+        self.assertIs(settings['broken'], microscope.devices.TIMED_OUT)
+
+    def test_stuck_group_not_read_again(self):
+        self.device.get_all_settings(timeout=0.1)
+        executor = self.device._settings_executor
+        for i in range(3):
+            settings = self.device.get_all_settings(timeout=0.1)
+            self.assertEqual(settings['fast'], 1)
+            self.assertIs(settings['slow'], microscope.devices.TIMED_OUT)
+        self.assertEqual(self.device.n_slow_reads, 1)
+        self.assertIs(self.device._settings_executor, executor)
+        self.assertLessEqual(len(executor._threads),
+                             self.device._settings_max_workers)
+
+    def test_stuck_group_read_again_once_done(self):
+        self.device.get_all_settings(timeout=0.1)
+        self.device.release.set()
+        self.device._settings_reads[('slow',)].result(timeout=1.0)
+        self.assertEqual(self.device.get_all_settings(timeout=1.0),
+                         {'fast': 1, 'slow': 2, 'broken': None})
+        self.assertEqual(self.device.n_slow_reads, 2)
+
+    def test_threads_stopped_on_shutdown(self):
+        self.device.release.set()
+        self.device.get_all_settings(timeout=1.0)
+        executor = self.device._settings_executor
+        self.device.shutdown()
+        self.assertIsNone(self.device._settings_executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(lambda: None)
+
+    def test_sentinel_pickles_by_reference(self):
+        import pickle
+        sentinel = microscope.devices.TIMED_OUT
+        self.assertIs(pickle.loads(pickle.dumps(sentinel)), sentinel)
+
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.device = dummies.TestCamera()
+        self.device.initialize()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filepath = os.path.join(tmpdir.name, 'camera.profile')
+
+    def test_profile_skips_readonly_settings(self):
+        self.device.add_setting('ro', 'int', lambda: 1, lambda v: None,
+                                (0, 1), readonly=True)
+        profile = self.device.get_profile()
+        self.assertIn('gain', profile)
+        self.assertNotIn('ro', profile)
+
+    def test_save_and_load(self):
+        self.device.set_setting('gain', 42)
+        self.device.set_setting('roi', (0, 0, 128, 256))
+        self.device.save_profile(self.filepath)
+
+        restarted = dummies.TestCamera()
+        restarted.initialize()
+        results = restarted.load_profile(self.filepath)
+        self.assertEqual(restarted.get_setting('gain'), 42)
+        self.assertEqual(tuple(restarted.get_setting('roi')),
+                         (0, 0, 128, 256))
+        ## Only the changed settings are set.
+        self.assertEqual(set(results.keys()), {'gain', 'roi'})
+
+    def test_save_numpy_and_tuple_values(self):
+        self.device.add_setting('np-int', 'int', lambda: numpy.int64(3),
+                                lambda v: None, (0, 10))
+        self.device.add_setting('np-float', 'float', lambda: numpy.float32(.5),
+                                lambda v: None, (0, 1))
+        self.device.add_setting('pair', 'enum',
+                                lambda: (numpy.uint16(1), 'one'),
+                                lambda v: None, {1: 'one'})
+        self.device.save_profile(self.filepath)
+        with open(self.filepath, 'r') as fh:
+            profile = json.load(fh)
+        self.assertEqual(profile['np-int'], 3)
+        self.assertEqual(profile['np-float'], 0.5)
+        self.assertEqual(profile['pair'], [1, 'one'])
+
+    def test_save_skips_unreadable_settings(self):
+        def broken():
+            raise RuntimeError('broken getter')
+        self.device.add_setting('broken', 'int', broken, lambda v: None,
+                                (0, 1))
+        with self.assertLogs('microscope.devices', level='WARNING'):
+            self.device.save_profile(self.filepath)
+        with open(self.filepath, 'r') as fh:
+            profile = json.load(fh)
+        self.assertNotIn('broken', profile)
+        self.assertIn('gain', profile)
+
+    def test_failed_save_keeps_previous_profile(self):
+        self.device.save_profile(self.filepath)
+        with open(self.filepath, 'r') as fh:
+            previous = fh.read()
+        self.device.add_setting('unsaveable', 'int', lambda: object(),
+                                lambda v: None, (0, 1))
+        with self.assertRaises(TypeError):
+            self.device.save_profile(self.filepath)
+        with open(self.filepath, 'r') as fh:
+            self.assertEqual(fh.read(), previous)
+
+    def test_load_toggles_acquisition_once(self):
+        self.device.set_setting('gain', 42)
+        self.device.set_setting('a_setting', 7)
+        self.device.save_profile(self.filepath)
+
+        restarted = dummies.TestCamera()
+        restarted.initialize()
+        restarted.enable()
+        self.addCleanup(restarted.disable)
+        with unittest.mock.patch.object(restarted, 'abort',
+                                        wraps=restarted.abort) as abort:
+            restarted.load_profile(self.filepath)
+        self.assertEqual(abort.call_count, 1)
+        self.assertTrue(restarted._acquiring)
+
+    def test_load_carries_on_after_failed_setting(self):
+        self.device.set_setting('gain', 42)
+        self.device.set_setting('a_setting', 7)
+        self.device.save_profile(self.filepath)
+
+        restarted = dummies.TestCamera()
+        restarted.initialize()
+        restarted.enable()
+        self.addCleanup(restarted.disable)
+        def broken(value):
+            raise RuntimeError('broken setter')
+        ## 'a_setting' is restored before 'gain'.
+        restarted._settings['a_setting']._set = broken
+        with self.assertLogs('microscope.devices', level='ERROR'):
+            with self.assertRaises(microscope.devices.ProfileError) as cm:
+                restarted.load_profile(self.filepath)
+        self.assertEqual(cm.exception.failed, ['a_setting'])
+        self.assertEqual(cm.exception.results, {'gain': 42})
+        self.assertEqual(restarted.get_setting('gain'), 42)
+        self.assertTrue(restarted._acquiring)
+
+
 if __name__ == '__main__':
     unittest.main()